@@ -1,158 +1,274 @@
 # 从CSV文件中读取abstract并embedding，完成后存faiss库 (使用BCEmbedding)
+import argparse
 import os
-import pandas as pd
+import sys
 import glob
-import faiss
-import numpy as np
-from typing import List
-import time
-from sentence_transformers import SentenceTransformer
+import xml.etree.ElementTree as ET
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# embedding / index_factory / metadata_store 与教材索引共用 (Textbook_embedding_Yaxi)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Textbook_embedding_Yaxi"))
+from chunking import chunk_spans
+from jats_parser import parse_jats
+from embedding import encode_to_array
+from encoders import load_encoder
+from index_factory import build_index, recall_at_k, write_index
+from metadata_store import (ChunkStore, append_chunk_store, chunk_store_exists, trim_chunk_store,
+                            write_chunk_store)
+from paths import ABSTRACTS_FAISS_INDEX, ABSTRACTS_METADATA_STORE
 
 # === CONFIG ===
 CSV_DIR = "/remote-home/jiayuguo/RAG-search/results/"  # CSV文件目录
 CHUNK_SIZE = 1000  # abstract通常较短，可以设置smaller chunk size
-FAISS_INDEX_PATH = "/remote-home/jiayuguo/RAG-search/abstracts_index.faiss"
-METADATA_PATH = "/remote-home/jiayuguo/RAG-search/abstracts_metadata.csv"
-BATCH_SIZE = 10  # 批处理大小
+FAISS_INDEX_PATH = str(ABSTRACTS_FAISS_INDEX)
+METADATA_PATH = str(ABSTRACTS_METADATA_STORE)  # .jsonl + .offsets.npy
+BATCH_SIZE = None  # 批处理大小；None = 按可用内存自动选择
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "flat")  # flat | hnsw | ivf | ivfpq
+RECALL_K = 10
+PMID_ID_STRIDE = 10_000  # FAISS id = PMID * PMID_ID_STRIDE + chunk_index
+PMC_XML_DIR = os.path.join(CSV_DIR, "pmc_xml")  # pubmed_fulltext_query.py 下载的全文
+FULLTEXT_CHUNK_OFFSET = 1000  # abstract chunk_index < 1000；全文 chunk_index 从 1000 开始
+CSV_CHUNKSIZE = 50_000  # 每次从CSV读取的行数
+ABSTRACT_COLUMNS = ['PMID', 'Title', 'Abstract', 'Journal', 'Date']
+METADATA_COLUMNS = ['pmid', 'title', 'text', 'chunk_index', 'total_chunks',
+                    'char_start', 'char_end', 'section', 'section_type',
+                    'journal', 'date', 'source_file']
 
-print("🔧 Configuration loaded.")
-print(f"CSV directory: {CSV_DIR}")
-print(f"Chunk size: {CHUNK_SIZE}")
-print(f"Batch size: {BATCH_SIZE}\n")
-
-# === INIT EMBEDDING MODEL ===
-model = SentenceTransformer("maidalun1020/bce-embedding-base_v1")
-embedding_dim = model.get_sentence_embedding_dimension()
-print(f"✅ BCEmbedding model loaded. Dimension: {embedding_dim}")
+MODEL_NAME = "maidalun1020/bce-embedding-base_v1"
+# pandas / faiss / numpy 和模型都在用到时才加载：import 本模块没有副作用
 
 # === FUNCTIONS ===
-def extract_abstracts_from_csv(csv_path: str) -> List[dict]:
-    try:
-        df = pd.read_csv(csv_path)
-        abstracts_data = []
-
-        for idx, row in df.iterrows():
-            abstract = str(row.get('Abstract', '')).strip()
-            if abstract and abstract != 'nan' and len(abstract) > 50:
-                abstracts_data.append({
-                    'pmid': row.get('PMID', ''),
-                    'title': row.get('Title', ''),
-                    'abstract': abstract,
-                    'journal': row.get('Journal', ''),
-                    'date': row.get('Date', ''),
-                    'source_file': os.path.basename(csv_path)
-                })
-
-        print(f"✅ 从 {csv_path} 提取了 {len(abstracts_data)} 个有效abstract")
-        return abstracts_data
-
-    except Exception as e:
-        print(f"❌ Error reading {csv_path}: {e}")
-        return []
-
-def chunk_text(text: str, max_length: int = 1000) -> List[str]:
-    if len(text) <= max_length:
-        return [text]
-    chunks = []
-    while len(text) > max_length:
-        split_idx = text.rfind('.', 0, max_length)
-        if split_idx == -1:
-            split_idx = max_length
-        chunks.append(text[:split_idx+1].strip())
-        text = text[split_idx+1:].strip()
-    if text:
-        chunks.append(text)
-    return chunks
-
-# === FIND ALL CSV FILES ===
-print("\n📄 Finding CSV files...")
-csv_files = glob.glob(os.path.join(CSV_DIR, "*.csv"))
-print(f"✅ Found {len(csv_files)} CSV files.")
-
-if not csv_files:
-    print("❌ No CSV files found in results directory!")
-    exit(1)
-
-# === INIT FAISS ===
-index = faiss.IndexFlatL2(embedding_dim)
-metadata = []
-
-# === PROCESS CSV FILES ===
-total_abstracts = 0
-for csv_file in csv_files:
-    print(f"\n📄 Processing CSV: {csv_file}")
-    abstracts_data = extract_abstracts_from_csv(csv_file)
-
-    if not abstracts_data:
-        print("⚠️ No valid abstracts found. Skipping.")
-        continue
-
-    texts_to_embed = []
-    current_metadata = []
-
-    for data in abstracts_data:
-        abstract = data['abstract']
-        chunks = chunk_text(abstract, max_length=CHUNK_SIZE)
-
-        for i, chunk in enumerate(chunks):
-            texts_to_embed.append(chunk)
-            current_metadata.append({
-                'pmid': data['pmid'],
-                'title': data['title'],
-                'text': chunk,
-                'chunk_index': i,
-                'total_chunks': len(chunks),
-                'journal': data['journal'],
-                'date': data['date'],
-                'source_file': data['source_file']
-            })
-
-    if not texts_to_embed:
-        continue
-
-    print(f"✂️  Created {len(texts_to_embed)} text chunks for embedding.")
+def filter_abstracts(df: "pd.DataFrame", source_file: str) -> "pd.DataFrame":
+    """向量化过滤：去掉空/过短abstract，PMID 转为可空整数列。"""
+    import pandas as pd
+
+    df = df.reindex(columns=ABSTRACT_COLUMNS)
+    abstract = df['Abstract'].str.strip()
+    mask = abstract.str.len().fillna(0) > 50
+    df = df.loc[mask]
+    return pd.DataFrame({
+        'pmid': pd.to_numeric(df['PMID'], errors='coerce').astype('Int64'),
+        'title': df['Title'],
+        'abstract': abstract[mask],
+        'journal': df['Journal'],
+        'date': df['Date'],
+        'source_file': source_file,
+    })
+
+def iter_abstract_frames(csv_files: List[str], chunksize: int = CSV_CHUNKSIZE):
+    """把所有期刊CSV当作一个分块读取流：只读需要的列，每块已过滤。"""
+    import pandas as pd
+
+    for csv_path in csv_files:
+        source_file = os.path.basename(csv_path)
+        try:
+            reader = pd.read_csv(csv_path, usecols=lambda c: c in ABSTRACT_COLUMNS,
+                                 dtype=str, chunksize=chunksize)
+            for df in reader:
+                frame = filter_abstracts(df, source_file)
+                print(f"✅ 从 {source_file} 提取了 {len(frame)} 个有效abstract")
+                yield frame
+        except Exception as e:
+            print(f"❌ Error reading {csv_path}: {e}")
+
+def fulltext_chunks(xml_path: str, pmid: int):
+    """一篇 PMC 全文 -> (id, text, metadata) 列表；abstract 已从CSV索引，这里跳过。"""
+    rows = []
+    chunk_index = FULLTEXT_CHUNK_OFFSET
+    for section in parse_jats(xml_path):  # 流式解析，不加载整棵XML树
+        if section.section_type == 'abstract':
+            continue
+        for chunk in chunk_spans(section.text, max_length=CHUNK_SIZE):
+            if chunk_index >= PMID_ID_STRIDE:
+                break
+            rows.append((pmid * PMID_ID_STRIDE + chunk_index, chunk.text, {
+                'pmid': pmid, 'title': section.article_title, 'text': chunk.text,
+                'chunk_index': chunk_index, 'char_start': chunk.start, 'char_end': chunk.end,
+                'section': section.title, 'section_type': section.section_type,
+                'journal': '', 'date': '', 'source_file': os.path.basename(xml_path),
+            }))
+            chunk_index += 1
+    for _, _, record in rows:
+        record['total_chunks'] = len(rows)
+    return rows
 
+def collect_fulltext(skip_pmids):
+    """扫描 PMC_XML_DIR，返回尚未索引全文的文章的 (ids, texts, metadata)。"""
+    ids, texts, metadata = [], [], []
+    xml_files = sorted(glob.glob(os.path.join(PMC_XML_DIR, "*.xml")))
+    parsed = failed = 0
+    for xml_path in xml_files:
+        stem = os.path.splitext(os.path.basename(xml_path))[0]
+        if not stem.isdigit() or int(stem) in skip_pmids:
+            continue
+        try:
+            rows = fulltext_chunks(xml_path, int(stem))
+        except ET.ParseError as e:
+            print(f"❌ Error parsing {xml_path}: {e}")
+            failed += 1
+            continue
+        parsed += 1
+        for vid, text, record in rows:
+            ids.append(vid)
+            texts.append(text)
+            metadata.append(record)
+    print(f"📰 Full text: parsed {parsed} new articles ({failed} failed) of {len(xml_files)} XML files, "
+          f"{len(texts)} chunks")
+    return ids, texts, metadata
+
+def load_existing_index():
+    """已有索引 (IndexIDMap2) 及其已有的向量 id；不存在或为旧格式时返回 None。
+
+    向量 id 取自索引本身而非元数据：若上次运行在写元数据之后、写索引之前中断，
+    元数据末尾多出的记录会被截掉，这些PMID下次重新编码。
+    """
+    if not (os.path.exists(FAISS_INDEX_PATH) and chunk_store_exists(METADATA_PATH)):
+        return None
+    store = ChunkStore(METADATA_PATH)
+    legacy = store.ids is None  # 旧版按位置编号的索引，无法增量更新
+    store.close()
+    if legacy:
+        return None
+    import faiss
+
+    index = faiss.read_index(FAISS_INDEX_PATH)
+    ids = faiss.vector_to_array(index.id_map).astype("int64")
     try:
-        all_embeddings = []
-        for i in range(0, len(texts_to_embed), BATCH_SIZE):
-            batch_texts = texts_to_embed[i:i+BATCH_SIZE]
-            batch_num = i//BATCH_SIZE + 1
-            total_batches = (len(texts_to_embed) + BATCH_SIZE - 1)//BATCH_SIZE
-            print(f"📦 Processing batch {batch_num}/{total_batches}")
-
-            batch_embeddings = model.encode(batch_texts)
-            all_embeddings.extend(batch_embeddings.tolist())
-            print(f"✅ Batch {batch_num} completed. Total embeddings so far: {len(all_embeddings)}")
-
-        if len(all_embeddings) != len(texts_to_embed):
-            print(f"⚠️ Warning: Expected {len(texts_to_embed)} embeddings, got {len(all_embeddings)}")
-
-        if all_embeddings:
-            embeddings_array = np.array(all_embeddings).astype("float32")
-            index.add(embeddings_array)
-            metadata.extend(current_metadata[:len(all_embeddings)])
-            total_abstracts += len(abstracts_data)
-            print(f"📌 Added {len(all_embeddings)} embeddings to FAISS.")
-
-    except Exception as e:
-        print(f"❌ Embedding failed for {csv_file}: {e}")
-        continue
-
-print(f"\n🎉 Total processed: {total_abstracts} abstracts from {len(csv_files)} files")
-print(f"📊 Total chunks in FAISS index: {len(metadata)}")
-
-# === SAVE FAISS INDEX AND METADATA ===
-print("\n💾 Saving FAISS index and metadata...")
-faiss.write_index(index, FAISS_INDEX_PATH)
-
-metadata_df = pd.DataFrame(metadata)
-metadata_df.to_csv(
-    METADATA_PATH,
-    index=False,
-    escapechar='\\',
-    quoting=1
-)
-
-print(f"\n✅ FAISS index saved to: {FAISS_INDEX_PATH}")
-print(f"✅ Metadata saved to: {METADATA_PATH}")
-print(f"📈 Index contains {index.ntotal} vectors")
+        dropped = trim_chunk_store(METADATA_PATH, ids)
+    except ValueError as e:
+        print(f"⚠️ Metadata does not match the index ({e}); rebuilding.")
+        return None
+    if dropped:
+        print(f"🩹 Dropped {dropped} metadata records with no vector in the index.")
+    return index, ids
+
+def main(full: bool = False, fulltext: bool = True):
+    import faiss
+    import numpy as np
+    import pandas as pd
+
+    print("🔧 Configuration loaded.")
+    print(f"CSV directory: {CSV_DIR}")
+    print(f"Chunk size: {CHUNK_SIZE}")
+    print(f"Batch size: {BATCH_SIZE or 'auto'}")
+    print(f"Index type: {INDEX_TYPE}\n")
+
+    # === INIT EMBEDDING MODEL ===
+    model = load_encoder(MODEL_NAME)  # ENCODER_BACKEND=onnx-int8 可不加载 torch
+    embedding_dim = model.get_sentence_embedding_dimension()
+    print(f"✅ BCEmbedding model loaded. Dimension: {embedding_dim}")
+
+    # === FIND ALL CSV FILES ===
+    print("\n📄 Finding CSV files...")
+    csv_files = sorted(glob.glob(os.path.join(CSV_DIR, "*.csv")))
+    print(f"✅ Found {len(csv_files)} CSV files.")
+
+    if not csv_files:
+        print("❌ No CSV files found in results directory!")
+        exit(1)
+
+    # === LOAD EXISTING INDEX (增量更新) ===
+    existing = None if full else load_existing_index()
+    if existing is not None:
+        index, existing_ids = existing
+        is_fulltext = existing_ids % PMID_ID_STRIDE >= FULLTEXT_CHUNK_OFFSET
+        indexed_pmids = set((existing_ids[~is_fulltext] // PMID_ID_STRIDE).tolist())
+        fulltext_pmids = set((existing_ids[is_fulltext] // PMID_ID_STRIDE).tolist())
+        print(f"📂 Existing index: {index.ntotal} vectors, {len(indexed_pmids)} PMIDs, "
+              f"{len(fulltext_pmids)} with full text.")
+    else:
+        index, indexed_pmids, fulltext_pmids = None, set(), set()
+        print("🏗️ Building a new index.")
+
+    # === COLLECT NEW ABSTRACTS ===
+    seen_pmids = set(indexed_pmids)  # 跨CSV去重 (同一PMID可能出现在多个期刊文件或重复查询中)
+    skipped_known = skipped_bad_pmid = 0
+    new_frames = []
+
+    # === STREAM CSV FILES ===
+    for frame in iter_abstract_frames(csv_files):
+        valid = frame[frame['pmid'].notna()]
+        skipped_bad_pmid += len(frame) - len(valid)
+        unique = valid.drop_duplicates('pmid')
+        fresh = unique[~unique['pmid'].isin(seen_pmids)]
+        skipped_known += len(valid) - len(fresh)
+        seen_pmids.update(fresh['pmid'].tolist())
+        new_frames.append(fresh)
+
+    abstracts = (pd.concat(new_frames, ignore_index=True) if new_frames
+                 else filter_abstracts(pd.DataFrame(columns=ABSTRACT_COLUMNS), ''))
+
+    # === CHUNK ===
+    # 每个abstract -> chunk列表（线性时间，带字符偏移），再 explode 成每行一个chunk
+    spans = abstracts['abstract'].map(lambda t: chunk_spans(t, max_length=CHUNK_SIZE))
+    chunks = abstracts.assign(span=spans).explode('span').dropna(subset=['span'])
+    chunks['text'] = [c.text for c in chunks['span']]
+    chunks['char_start'] = [c.start for c in chunks['span']]
+    chunks['char_end'] = [c.end for c in chunks['span']]
+    chunks['section'] = 'Abstract'
+    chunks['section_type'] = 'abstract'
+    chunks['chunk_index'] = chunks.groupby(level=0).cumcount()
+    chunks['total_chunks'] = chunks.groupby(level=0)['text'].transform('size')
+    chunks = chunks[chunks['chunk_index'] < FULLTEXT_CHUNK_OFFSET].reset_index(drop=True)
+    chunks['pmid'] = chunks['pmid'].astype('int64')
+
+    new_ids = (chunks['pmid'].to_numpy() * PMID_ID_STRIDE + chunks['chunk_index'].to_numpy()).tolist()
+    all_texts = chunks['text'].tolist()
+    metadata = chunks[METADATA_COLUMNS].to_dict('records')
+
+    # === FULL TEXT (PMC XML) ===
+    # 全文按章节 / 图表标题切分，与abstract共用同一索引，chunk_index >= FULLTEXT_CHUNK_OFFSET
+    if fulltext and os.path.isdir(PMC_XML_DIR):
+        ft_ids, ft_texts, ft_metadata = collect_fulltext(fulltext_pmids)
+        new_ids += ft_ids
+        all_texts += ft_texts
+        metadata += ft_metadata
+
+    print(f"\n🎉 Total processed: {len(abstracts)} new abstracts from {len(csv_files)} files")
+    print(f"⏩ Skipped {skipped_known} already-indexed/duplicate PMIDs, {skipped_bad_pmid} rows without a valid PMID")
+    print(f"📊 New chunks: {len(metadata)} (abstracts + full text)")
+
+    # === EMBED ===
+    # 所有新chunk一次性编码：按长度排序分批，直接写入预分配的float32数组
+    vectors = encode_to_array(model, all_texts, batch_size=BATCH_SIZE)
+
+    # === BUILD / UPDATE FAISS INDEX ===
+    ids = np.asarray(new_ids, dtype="int64")
+    if index is not None:
+        if len(vectors):
+            print(f"\n➕ Appending {len(vectors)} vectors to the existing index...")
+            index.add_with_ids(vectors, ids)
+    else:
+        print(f"\n🧱 Building {INDEX_TYPE} index over {len(vectors)} vectors...")
+        if len(vectors):
+            index = build_index(INDEX_TYPE, vectors, ids=ids)
+        else:
+            index = faiss.IndexIDMap2(faiss.IndexFlatL2(embedding_dim))
+        if INDEX_TYPE != "flat" and len(vectors):
+            recall = recall_at_k(index, vectors, k=RECALL_K, ids=ids)
+            print(f"🎯 Recall@{RECALL_K} vs exact flat search: {recall:.3f}")
+
+    # === SAVE FAISS INDEX AND METADATA ===
+    # 先存元数据再存索引，两者都原子替换：失败时不会出现新索引配旧元数据
+    print("\n💾 Saving FAISS index and metadata...")
+    if existing is not None:
+        append_chunk_store(METADATA_PATH, metadata, new_ids)  # 只追加新记录
+    else:
+        write_chunk_store(METADATA_PATH, metadata, ids=new_ids)
+    write_index(index, FAISS_INDEX_PATH)
+
+    print(f"\n✅ FAISS index saved to: {FAISS_INDEX_PATH}")
+    print(f"✅ Metadata saved to: {METADATA_PATH}")
+    print(f"📈 Index contains {index.ntotal} vectors")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true",
+                        help="ignore the existing index and re-embed every abstract")
+    parser.add_argument("--no-fulltext", action="store_true",
+                        help="index abstracts only, skip PMC full-text XML")
+    args = parser.parse_args()
+    main(args.full, fulltext=not args.no_fulltext)
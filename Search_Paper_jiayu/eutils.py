@@ -0,0 +1,185 @@
+"""NCBI E-utilities 传输层：可替换的 transport + 磁盘请求缓存 + 期刊进度账本。
+
+* ``UrllibTransport`` 直接用 urllib 请求 E-utilities，``base_url`` 可配置，
+  指向 ``eutils_fixture_server.py`` 即可离线测试 / 压测
+* ``CachedTransport`` 把任意 transport 的响应存进 SQLite，按 ``CACHE_TTL``
+  的有效期复用；esearch 有效期很短（否则永远看不到新发表的文章），
+  PMC 全文不进缓存（已单独存盘）
+* ``HarvestLedger`` 记录每个期刊是否已完成，重跑时跳过
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+from typing import Dict, Optional
+
+EUTILS_URL = os.environ.get("EUTILS_BASE_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/")
+# 不影响响应内容的参数，不参与缓存 key
+IDENTITY_PARAMS = ("api_key", "email", "tool")
+# "endpoint:db" -> 缓存有效期（秒）；不在表中的请求（如 efetch:pmc 全文）不缓存
+CACHE_TTL = {
+    "esearch:pubmed": 3600,         # 新文章随时出现
+    "elink:pmc": 7 * 86400,         # PMC 全文可能在禁运期后才有链接
+    "efetch:pubmed": 30 * 86400,
+}
+
+
+def cache_label(endpoint: str, params: Dict) -> str:
+    return f"{endpoint}:{params.get('db', '')}"
+
+
+class UrllibTransport:
+    """POST 到 ``{base_url}{endpoint}.fcgi``，返回响应字节。
+
+    ``limiter`` 为共享的 ``TokenBucket``（所有线程的总速率受限）。
+    列表参数（如 elink 的多个 id）会展开成重复的 ``id=``。
+    """
+
+    def __init__(self, base_url: str = EUTILS_URL, limiter=None, timeout: float = 60.0,
+                 identity: Optional[Dict[str, str]] = None):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.limiter = limiter
+        self.timeout = timeout
+        self.identity = {k: v for k, v in (identity or {}).items() if v}
+
+    def request(self, endpoint: str, params: Dict) -> bytes:
+        data = urllib.parse.urlencode({**params, **self.identity}, doseq=True).encode("ascii")
+        req = urllib.request.Request(f"{self.base_url}{endpoint}.fcgi", data=data)
+        if self.limiter is not None:
+            self.limiter.acquire()
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return resp.read()
+
+
+def request_key(endpoint: str, params: Dict) -> str:
+    payload = json.dumps(
+        {"endpoint": endpoint,
+         "params": {k: v for k, v in params.items() if k not in IDENTITY_PARAMS}},
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RequestCache:
+    """SQLite 响应缓存，key 为 (endpoint, 参数) 的哈希。"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, endpoint TEXT NOT NULL,"
+            " body BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[bytes]:
+        """``max_age`` 秒以前存的响应视为过期，返回 None。"""
+        with self._lock:
+            row = self._conn.execute("SELECT body, created FROM responses WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is not None and max_age is not None and row[1] < time.time() - max_age:
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, endpoint: str, body: bytes):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, endpoint, body, time.time()),
+            )
+            self._conn.commit()
+
+    def evict(self, ttl: Dict[str, float]) -> int:
+        """删除已过期的、以及 ``ttl`` 中没有的类别的响应（如旧版存下的 PMC 全文）。"""
+        now = time.time()
+        with self._lock:
+            removed = self._conn.execute(
+                f"DELETE FROM responses WHERE endpoint NOT IN ({','.join('?' * len(ttl))})",
+                tuple(ttl)).rowcount
+            for label, max_age in ttl.items():
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE endpoint = ? AND created < ?",
+                    (label, now - max_age)).rowcount
+            self._conn.commit()
+            if removed:
+                self._conn.execute("VACUUM")  # 释放大块全文占用的磁盘空间
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedTransport:
+    """先查缓存，未命中或过期再走底层 transport；只缓存成功的响应。
+
+    只缓存 ``ttl`` 中列出的请求类别，各按其有效期；打开时清掉过期条目。
+    """
+
+    def __init__(self, transport, cache: RequestCache, ttl: Optional[Dict[str, float]] = None):
+        self.transport = transport
+        self.cache = cache
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        cache.evict(self.ttl)
+
+    def request(self, endpoint: str, params: Dict) -> bytes:
+        label = cache_label(endpoint, params)
+        if label not in self.ttl:
+            return self.transport.request(endpoint, params)
+        key = request_key(endpoint, params)
+        body = self.cache.get(key, max_age=self.ttl[label])
+        if body is None:
+            body = self.transport.request(endpoint, params)
+            self.cache.put(key, label, body)
+        return body
+
+
+class HarvestLedger:
+    """每个期刊一条记录的 JSON 进度账本，原子写入，线程安全。
+
+    查询条件（``query_hash``）变化时账本作废，所有期刊重新抓取。
+    """
+
+    def __init__(self, path, query_hash: str):
+        self.path = path
+        self.query_hash = query_hash
+        self._lock = threading.Lock()
+        self.journals = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("query_hash") == query_hash:
+                self.journals = data.get("journals", {})
+
+    def is_done(self, journal: str) -> bool:
+        entry = self.journals.get(journal) or {}
+        csv_path = entry.get("csv")  # 无结果的期刊没有 CSV
+        return entry.get("status") == "done" and (not csv_path or os.path.exists(csv_path))
+
+    def mark_done(self, journal: str, **info):
+        with self._lock:
+            self.journals[journal] = {"status": "done", "finished": time.time(), **info}
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"query_hash": self.query_hash, "journals": self.journals},
+                          f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
@@ -0,0 +1,161 @@
+"""本地 E-utilities 替身：离线测试和压测 ``pubmed_fulltext_query.py`` 用。
+
+实现 esearch（JSON）、efetch（MEDLINE 文本 / PMC XML）、elink（JSON）三个接口，
+数据由查询词确定性生成：同一查询永远得到同样的 PMID、摘要和全文。
+偶数 PMID 有 PMC 全文。
+
+    python Search_Paper_jiayu/eutils_fixture_server.py --port 8790 --latency-ms 50
+    python Search_Paper_jiayu/pubmed_fulltext_query.py --base-url http://127.0.0.1:8790/ --out /tmp/harvest
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+PER_QUERY = 300  # 每个查询返回的 PMID 数
+
+
+def fixture_pmids(term: str, retmax: int, per_query: int = PER_QUERY) -> List[str]:
+    base = int(hashlib.sha256(term.encode("utf-8")).hexdigest()[:6], 16) * 1000 + 10_000_000
+    return [str(base + i) for i in range(min(retmax, per_query))]
+
+
+def pmc_id_for(pmid: str):
+    return str(int(pmid) + 1_000_000_000) if int(pmid) % 2 == 0 else None
+
+
+def medline_record(pmid: str) -> str:
+    return (
+        f"PMID- {pmid}\n"
+        f"TI  - Synthetic hydrogel study {pmid}.\n"
+        f"AB  - This synthetic abstract describes a biocompatible hydrogel for drug\n"
+        f"      delivery, record {pmid}. Release was sustained over 14 days.\n"
+        f"JT  - Fixture Journal of Biomaterials\n"
+        f"DP  - 2020 Jan\n"
+        f"PT  - Journal Article\n"
+        f"LID - 10.0000/fixture.{pmid} [doi]\n"
+    )
+
+
+def pmc_article(pmid: str, pmc_id: str) -> str:
+    return (
+        '<article xmlns:xlink="http://www.w3.org/1999/xlink" article-type="research-article">'
+        "<front><article-meta>"
+        f'<article-id pub-id-type="pmid">{pmid}</article-id>'
+        f'<article-id pub-id-type="pmc">PMC{pmc_id}</article-id>'
+        f"<title-group><article-title>Synthetic hydrogel study {pmid}</article-title></title-group>"
+        f"<abstract><p>Abstract of fixture article {pmid}.</p></abstract>"
+        "</article-meta></front><body>"
+        '<sec><title>Introduction</title><p>Hydrogels are water-swollen polymer networks. '
+        "They are widely used for controlled drug delivery.</p></sec>"
+        '<sec><title>Methods</title><p>Gels were crosslinked and loaded with a model drug.</p>'
+        '<fig id="f1"><label>Figure 1</label><caption><p>Cumulative release over 14 days.</p>'
+        "</caption></fig></sec>"
+        "<sec><title>Results</title><p>Release was sustained and cells remained viable.</p></sec>"
+        "</body></article>"
+    )
+
+
+def handle_request(endpoint: str, params: Dict[str, List[str]]):
+    """返回 ``(content_type, body)``；未知接口抛 KeyError。"""
+    first = lambda name, default="": params.get(name, [default])[0]
+    if endpoint == "esearch":
+        ids = fixture_pmids(first("term"), int(first("retmax", "20")))
+        payload = {"esearchresult": {"count": str(len(ids)), "idlist": ids}}
+        return "application/json", json.dumps(payload)
+    if endpoint == "elink":
+        ids = [i for value in params.get("id", []) for i in value.split(",") if i]
+        linksets = []
+        for pmid in ids:
+            linkset = {"dbfrom": "pubmed", "ids": [pmid]}
+            pmc_id = pmc_id_for(pmid)
+            if pmc_id:
+                linkset["linksetdbs"] = [{"dbto": "pmc", "linkname": "pubmed_pmc", "links": [pmc_id]}]
+            linksets.append(linkset)
+        return "application/json", json.dumps({"linksets": linksets})
+    if endpoint == "efetch":
+        ids = [i for i in first("id").split(",") if i]
+        if first("db") == "pmc":
+            articles = "".join(pmc_article(str(int(i) - 1_000_000_000), i) for i in ids)
+            return "text/xml", f'<?xml version="1.0"?>\n<pmc-articleset>{articles}</pmc-articleset>'
+        return "text/plain", "\n".join(medline_record(i) for i in ids)
+    raise KeyError(endpoint)
+
+
+def make_handler(latency_ms: float = 0.0, fail_rate: float = 0.0, seed: int = 0):
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    counts = {"requests": 0, "throttled": 0}
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._handle(parse_qs(urlparse(self.path).query))
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            params = parse_qs(urlparse(self.path).query)
+            for key, values in parse_qs(self.rfile.read(length).decode("utf-8")).items():
+                params.setdefault(key, []).extend(values)
+            self._handle(params)
+
+        def _handle(self, params):
+            endpoint = urlparse(self.path).path.rstrip("/").rsplit("/", 1)[-1].replace(".fcgi", "")
+            with rng_lock:
+                counts["requests"] += 1
+                throttle = rng.random() < fail_rate
+                if throttle:
+                    counts["throttled"] += 1
+            if latency_ms:
+                time.sleep(latency_ms / 1000.0)
+            if throttle:
+                self._reply(429, "text/plain", "API rate limit exceeded")
+                return
+            try:
+                content_type, body = handle_request(endpoint, params)
+            except KeyError:
+                self._reply(404, "text/plain", "not found")
+                return
+            self._reply(200, content_type, body)
+
+        def _reply(self, status, content_type, body):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    FixtureHandler.counts = counts
+    return FixtureHandler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8790, latency_ms: float = 0.0,
+          fail_rate: float = 0.0):
+    handler = make_handler(latency_ms, fail_rate)
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"✅ E-utilities fixture server listening on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"📊 {handler.counts['requests']} requests, {handler.counts['throttled']} throttled (429)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每个请求模拟的往返延迟")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 429 的请求比例")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.latency_ms, args.fail_rate)
@@ -0,0 +1,145 @@
+"""流式 JATS（PMC 全文 XML）解析：按章节 / 图表标题产出文本。
+
+用 ``ElementTree.iterparse`` 边读边解析，段落、章节、参考文献处理完立即
+``clear()`` 并从父节点摘掉，内存占用与单个章节大小相关，而不是整篇文章。
+
+每个 ``Section`` 带 PMID / PMCID、章节标题路径（如 ``Methods > Cell culture``）
+和归一化的章节类型（abstract / introduction / methods / results / discussion /
+conclusion / figure / table / other）。
+"""
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+SECTION_TYPES = (
+    ("introduction", ("introduction", "background")),
+    ("methods", ("method", "materials", "experimental", "procedure")),
+    ("results", ("result", "finding")),
+    ("discussion", ("discussion",)),
+    ("conclusion", ("conclusion", "summary")),
+)
+SKIP = {"ref-list", "back", "supplementary-material"}  # 不索引的部分
+NOT_PARAGRAPH = {"caption", "fig", "table-wrap"} | SKIP  # 这些元素内的 <p> 不算正文段落
+# 行内标记：与前后文字直接相连（H<sub>2</sub>O）；其他子元素前后补空格
+INLINE = {"italic", "bold", "sub", "sup", "underline", "sc", "monospace", "xref",
+          "ext-link", "named-content", "styled-content", "inline-formula"}
+# 处理完即释放的元素
+RELEASE = {"p", "sec", "fig", "table-wrap", "abstract", "body", "article-meta", "journal-meta"} | SKIP
+
+
+@dataclass
+class Section:
+    pmid: Optional[str]
+    pmc_id: Optional[str]
+    article_title: str
+    title: str          # 章节标题路径，或图表标签
+    section_type: str
+    text: str
+
+
+def section_type(title: str) -> str:
+    lowered = title.lower()
+    for kind, keywords in SECTION_TYPES:
+        if any(k in lowered for k in keywords):
+            return kind
+    return "other"
+
+
+def _local(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _pieces(elem) -> Iterator[str]:
+    yield elem.text or ""
+    for child in elem:
+        gap = "" if _local(child.tag) in INLINE else " "
+        yield gap
+        yield from _pieces(child)
+        yield gap
+        yield child.tail or ""
+
+
+def _text(elem) -> str:
+    """元素的全部文字；块级子元素（标题、段落等）之间以空格分隔。"""
+    return " ".join("".join(_pieces(elem)).split())
+
+
+def parse_jats(source) -> Iterator[Section]:
+    """逐个产出 ``source``（路径或文件对象）中的章节和图表标题。"""
+    stack: List[str] = []             # 当前打开的元素名
+    parents: list = []                # 与 stack 对应的元素本身
+    sec_titles: List[str] = []        # 每层 <sec> 的标题（无标题为 ""）
+    sec_paragraphs: List[List[str]] = []
+    abstract: List[str] = []
+    body: List[str] = []              # 直接位于 <body> 下、不属于任何 <sec> 的段落
+    label = ""
+    ids = {"pmid": None, "pmc": None}
+    article_title = ""
+
+    def emit(title, kind, text):
+        return Section(ids["pmid"], ids["pmc"], article_title, title, kind, text)
+
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        tag = _local(elem.tag)
+        if event == "start":
+            stack.append(tag)
+            parents.append(elem)
+            if tag == "sec":
+                sec_titles.append("")
+                sec_paragraphs.append([])
+            continue
+
+        stack.pop()
+        parents.pop()
+        inside = set(stack)
+        if tag == "article-id":
+            id_type = elem.get("pub-id-type", "")
+            value = (elem.text or "").strip()
+            if id_type == "pmid":
+                ids["pmid"] = value
+            elif id_type in ("pmc", "pmcid"):
+                ids["pmc"] = value[3:] if value.upper().startswith("PMC") else value
+        elif tag == "article-title" and "article-meta" in inside and "title-group" in inside:
+            article_title = _text(elem)
+        elif tag == "title" and stack and stack[-1] == "sec" and sec_titles:
+            sec_titles[-1] = _text(elem)
+        elif tag == "p" and not inside & NOT_PARAGRAPH:
+            if "abstract" in inside:
+                abstract.append(_text(elem))
+            elif sec_paragraphs:
+                sec_paragraphs[-1].append(_text(elem))
+            elif "body" in inside:
+                body.append(_text(elem))
+        elif tag == "label" and stack and stack[-1] in ("fig", "table-wrap"):
+            label = _text(elem)
+        elif tag == "caption" and inside & {"fig", "table-wrap"}:
+            kind = "figure" if "fig" in inside else "table"
+            text = _text(elem)
+            if text:
+                yield emit(label or kind.title(), kind, text)
+        elif tag == "abstract":
+            if abstract:
+                yield emit("Abstract", "abstract", " ".join(abstract))
+            abstract = []
+        elif tag == "sec":
+            paragraphs = sec_paragraphs.pop()
+            path = " > ".join(t for t in sec_titles if t) or "Untitled"
+            top = next((t for t in sec_titles if t), "")
+            sec_titles.pop()
+            if paragraphs:
+                yield emit(path, section_type(top), " ".join(paragraphs))
+        elif tag == "body":
+            if body:
+                yield emit("Body", "other", " ".join(body))
+            body = []
+        elif tag in ("fig", "table-wrap"):
+            label = ""
+        elif tag == "article":
+            elem.clear()
+            ids = {"pmid": None, "pmc": None}
+            article_title = ""
+
+        if tag in RELEASE and "caption" not in inside:
+            elem.clear()
+            if parents:  # 摘掉空壳，否则父节点的子元素列表随章节数增长
+                parents[-1].remove(elem)
@@ -1,21 +1,37 @@
 ### 📘 PubMed 批量查询与全文抓取工具
 ##### 功能：限定期刊 + 关键词搜索，获取元数据+摘要+全文链接+PMC全文
 
-from Bio import Entrez, Medline
-import pandas as pd
-import time
+import argparse
+import hashlib
+import io
+import json
 import os
+import re
+import sys
+from typing import Dict, List
+
+from Bio import Medline
+import pandas as pd
 from tqdm import tqdm
-import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Textbook_embedding_Yaxi"))
+from runner import TokenBucket, call_with_backoff, run_in_order
+from eutils import EUTILS_URL, CachedTransport, HarvestLedger, RequestCache, UrllibTransport
 
 
 # 配置：邮箱和 API Key
-Entrez.email = "guojy23@m.fudan.edu.cn"  # 🔁 请替换为你自己的邮箱
-Entrez.api_key = "7eab3c9283e032b0a5b3451997ae12fb2208"
+EMAIL = "guojy23@m.fudan.edu.cn"  # 🔁 请替换为你自己的邮箱
+API_KEY = os.environ.get("NCBI_API_KEY", "7eab3c9283e032b0a5b3451997ae12fb2208")
 
-# 创建保存目录
-os.makedirs("results", exist_ok=True)
-os.makedirs("results/pmc_xml", exist_ok=True)
+RESULTS_DIR = "results"
+REQUESTS_PER_SECOND = 10 if API_KEY else 3  # NCBI 限速：有 API key 10 次/秒，否则 3 次/秒
+JOURNAL_WORKERS = 4    # 同时处理的期刊数
+DETAIL_BATCH = 200     # 每次 efetch 的 PubMed 记录数
+LINK_BATCH = 200       # 每次 elink 的 PMID 数
+PMC_BATCH = 50         # 每次 efetch 的 PMC 全文数
+RETRIES = 5
+CACHE_FILE = ".eutils_cache.sqlite"        # 位于输出目录下
+LEDGER_FILE = "harvest_progress.json"
 
 # ===== 1. 期刊列表（原始） =====
 journal_list_raw = [
@@ -46,72 +62,183 @@ AND ("drug delivery"[Title/Abstract] OR therapeutic[Title/Abstract])
 AND ("2014"[Date - Publication] : "2024"[Date - Publication])
 """
 
-# ===== 3. 批量查询函数 =====
-def search_pubmed(journal_name, retmax=1000):
+# ===== 3. 限速 + 重试的 NCBI 请求 =====
+def ncbi_get(transport, endpoint, **params) -> bytes:
+    """通过 transport 请求 E-utilities，失败时指数退避重试（429 退避加倍）。"""
+    return call_with_backoff(transport.request, endpoint, params, retries=RETRIES)
+
+def make_transport(base_url: str = EUTILS_URL, cache_path=None, clear_cache: bool = False):
+    limiter = TokenBucket(REQUESTS_PER_SECOND)  # 所有线程共享，总速率不超限
+    transport = UrllibTransport(base_url, limiter=limiter,
+                                identity={"email": EMAIL, "api_key": API_KEY, "tool": "biomaterialsgpt"})
+    if cache_path is not None:
+        cache = RequestCache(cache_path)
+        if clear_cache:
+            cache.clear()
+        transport = CachedTransport(transport, cache)
+    return transport
+
+# ===== 4. 批量查询函数 =====
+def search_pubmed(transport, journal_name, retmax=1000):
     full_query = f"{search_query} AND \"{journal_name}\"[Journal]"
-    handle = Entrez.esearch(db="pubmed", term=full_query, retmax=retmax)
-    record = Entrez.read(handle)
-    return record["IdList"]
-
-# ===== 4. 获取文献详情 =====
-def fetch_details(id_list):
-    handle = Entrez.efetch(db="pubmed", id=id_list, rettype="medline", retmode="text")
-    records = list(Medline.parse(handle))
-    return records
-
-# ===== 5. 获取 PMC 全文 XML（如有） =====
-def fetch_pmc_xml(pmid):
-    try:
-        link_handle = Entrez.elink(dbfrom="pubmed", db="pmc", id=pmid)
-        links = Entrez.read(link_handle)
-        pmc_id = links[0]['LinkSetDb'][0]['Link'][0]['Id']
-        xml_handle = Entrez.efetch(db="pmc", id=pmc_id, rettype="full", retmode="xml")
-        xml_data = xml_handle.read()
-        with open(f"results/pmc_xml/{pmid}.xml", "w", encoding="utf-8") as f:
-            f.write(xml_data)
-        return f"https://www.ncbi.nlm.nih.gov/pmc/articles/PMC{pmc_id}/"
-    except:
-        return ""
-
-
-# ===== 6. 主流程 =====
-for journal in tqdm(journal_list_raw):
-    print(f"\n🔍 正在查询期刊：{journal}")
-    pmids = search_pubmed(journal, retmax=1000)
-    time.sleep(1)
+    body = ncbi_get(transport, "esearch", db="pubmed", term=full_query, retmax=retmax, retmode="json")
+    return json.loads(body)["esearchresult"]["idlist"]
+
+# ===== 5. 获取文献详情 =====
+def fetch_details(transport, id_list):
+    body = ncbi_get(transport, "efetch", db="pubmed", id=",".join(id_list),
+                    rettype="medline", retmode="text")
+    return list(Medline.parse(io.StringIO(body.decode("utf-8"))))
+
+# ===== 6. 批量 PMID -> PMCID =====
+def link_pmc_ids(transport, pmids: List[str]) -> Dict[str, str]:
+    """一次 elink 请求映射多个 PMID（重复的 id= 参数，每个 PMID 返回一个 linkset）。
+
+    某批重试后仍失败时抛出异常，整个期刊记为失败，不写入进度账本。
+    """
+    mapping = {}
+    for i in range(0, len(pmids), LINK_BATCH):
+        batch = pmids[i:i + LINK_BATCH]
+        body = ncbi_get(transport, "elink", dbfrom="pubmed", db="pmc",
+                        linkname="pubmed_pmc", id=batch, retmode="json")
+        for linkset in json.loads(body).get("linksets", []):
+            for db in linkset.get("linksetdbs", []):
+                if db.get("links"):
+                    mapping[str(linkset["ids"][0])] = str(db["links"][0])
+                    break
+    return mapping
+
+ARTICLE_RE = re.compile(r"<article[\s>].*?</article>", re.S)
+PMC_ID_RE = re.compile(r'<article-id pub-id-type="pmc(?:id)?">\s*(?:PMC)?(\d+)\s*</article-id>')
+
+def split_pmc_articles(xml_data: str) -> Dict[str, str]:
+    """把 <pmc-articleset> 拆成单篇 <article>，按 PMCID 返回。"""
+    articles = {}
+    for match in ARTICLE_RE.finditer(xml_data):
+        article = match.group(0)
+        pmc_id = PMC_ID_RE.search(article)
+        if pmc_id:
+            articles[pmc_id.group(1)] = article
+    return articles
+
+def pmc_link(pmc_id: str) -> str:
+    return f"https://www.ncbi.nlm.nih.gov/pmc/articles/PMC{pmc_id}/"
+
+# ===== 7. 批量获取 PMC 全文 XML（如有） =====
+def fetch_pmc_xml_batch(transport, pmids: List[str], pmc_dir: str) -> Dict[str, str]:
+    """批量下载 PMC 全文并按 PMID 保存，返回 PMID -> PMC 链接。
+
+    已存在的 ``{pmid}.xml`` 不再下载。某批失败时抛出异常（同 ``link_pmc_ids``），
+    已保存的 XML 保留，续跑时只补缺失的部分。
+    """
+    pmc_ids = link_pmc_ids(transport, pmids)
+    links = {pmid: pmc_link(pmc_id) for pmid, pmc_id in pmc_ids.items()}
+    pmid_by_pmc = {pmc_id: pmid for pmid, pmc_id in pmc_ids.items()
+                   if not os.path.exists(os.path.join(pmc_dir, f"{pmid}.xml"))}
+    pmc_list = list(pmid_by_pmc)
+    for i in range(0, len(pmc_list), PMC_BATCH):
+        batch = pmc_list[i:i + PMC_BATCH]
+        body = ncbi_get(transport, "efetch", db="pmc", id=",".join(batch),
+                        rettype="full", retmode="xml")
+        articles = split_pmc_articles(body.decode("utf-8"))
+        for pmc_id in batch:
+            pmid = pmid_by_pmc[pmc_id]
+            if pmc_id not in articles:
+                links.pop(pmid, None)
+                continue
+            path = os.path.join(pmc_dir, f"{pmid}.xml")
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                f.write(articles[pmc_id])
+            os.replace(f"{path}.tmp", path)  # 中途退出不会留下半个 XML
+    return links
+
+# ===== 8. 单个期刊的完整流程 =====
+def harvest_journal(transport, journal, out_dir=RESULTS_DIR):
+    pmids = search_pubmed(transport, journal, retmax=1000)
     if not pmids:
-        continue
+        return None
 
+    pmc_dir = os.path.join(out_dir, "pmc_xml")
     all_data = []
-    for i in range(0, len(pmids), 200):
-        batch = pmids[i:i+200]
-        details = fetch_details(batch)
+    for i in range(0, len(pmids), DETAIL_BATCH):
+        batch = pmids[i:i + DETAIL_BATCH]
+        details = fetch_details(transport, batch)
+        pmc_links = fetch_pmc_xml_batch(
+            transport, [rec.get("PMID", "") for rec in details if rec.get("PMID")], pmc_dir)
         for rec in details:
             pmid = rec.get("PMID", "")
-            title = rec.get("TI", "")
-            abstract = rec.get("AB", "")
-            journal_name = rec.get("JT", "")
-            pubdate = rec.get("DP", "")
-            types = "; ".join(rec.get("PT", []))
-            doi = rec.get("LID", "").split()[0] if "LID" in rec else ""
-            link = f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
-            pmc_link = fetch_pmc_xml(pmid)
-
             all_data.append({
                 "PMID": pmid,
-                "Title": title,
-                "Abstract": abstract,
-                "Journal": journal_name,
-                "Date": pubdate,
-                "Types": types,
-                "DOI": doi,
-                "PubMed_Link": link,
-                "PMC_Link": pmc_link
+                "Title": rec.get("TI", ""),
+                "Abstract": rec.get("AB", ""),
+                "Journal": rec.get("JT", ""),
+                "Date": rec.get("DP", ""),
+                "Types": "; ".join(rec.get("PT", [])),
+                "DOI": rec.get("LID", "").split()[0] if "LID" in rec else "",
+                "PubMed_Link": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
+                "PMC_Link": pmc_links.get(pmid, ""),
             })
-        time.sleep(1)
 
     # 保存为 CSV
     df = pd.DataFrame(all_data)
-    save_path = f"results/{journal.replace(' ', '_')}.csv"
+    save_path = os.path.join(out_dir, f"{journal.replace(' ', '_')}.csv")
     df.to_csv(save_path, index=False)
-    print(f"✅ 已保存：{save_path}")
+    return save_path
+
+
+# ===== 9. 主流程 =====
+def main(workers: int = JOURNAL_WORKERS, out_dir: str = RESULTS_DIR,
+         base_url: str = EUTILS_URL, use_cache: bool = True, restart: bool = False):
+    os.makedirs(os.path.join(out_dir, "pmc_xml"), exist_ok=True)
+    # --restart 同时清空请求缓存，保证重新查询拿到最新结果
+    transport = make_transport(base_url, os.path.join(out_dir, CACHE_FILE) if use_cache else None,
+                               clear_cache=restart)
+
+    # 查询条件变了，账本自动作废
+    query_hash = hashlib.sha256(search_query.encode("utf-8")).hexdigest()[:16]
+    ledger_path = os.path.join(out_dir, LEDGER_FILE)
+    if restart and os.path.exists(ledger_path):
+        os.remove(ledger_path)
+    ledger = HarvestLedger(ledger_path, query_hash)
+    todo = [j for j in journal_list_raw if not ledger.is_done(j)]
+    if len(todo) < len(journal_list_raw):
+        print(f"⏩ 跳过 {len(journal_list_raw) - len(todo)} 个已完成的期刊")
+
+    progress = tqdm(total=len(todo))
+
+    def report(journal, save_path):
+        progress.update(1)
+        if save_path:
+            print(f"✅ 已保存：{save_path}")
+        else:
+            print(f"⚠️ 无结果：{journal}")
+
+    def safe_harvest(journal):
+        print(f"\n🔍 正在查询期刊：{journal}")
+        try:
+            save_path = harvest_journal(transport, journal, out_dir)
+        except Exception as e:
+            # 不记入账本：续跑时重新处理，缓存里已有的请求不会重发
+            print(f"❌ 期刊 {journal} 失败：{e}")
+            return None
+        ledger.mark_done(journal, csv=save_path)
+        return save_path
+
+    # 多个期刊并发；所有请求共用令牌桶，总速率不超过 NCBI 限制
+    run_in_order(todo, safe_harvest, max_workers=workers, on_result=report)
+    progress.close()
+    if isinstance(transport, CachedTransport):
+        print(f"💾 请求缓存：{transport.cache.hits} 命中，{transport.cache.misses} 未命中")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PubMed 批量查询与 PMC 全文抓取")
+    parser.add_argument("--workers", type=int, default=JOURNAL_WORKERS, help="并发处理的期刊数")
+    parser.add_argument("--out", default=RESULTS_DIR, help="输出目录（CSV、pmc_xml、缓存、进度账本）")
+    parser.add_argument("--base-url", default=EUTILS_URL,
+                        help="E-utilities 地址；本地测试时指向 eutils_fixture_server.py")
+    parser.add_argument("--no-cache", action="store_true", help="不使用磁盘请求缓存")
+    parser.add_argument("--restart", action="store_true", help="忽略进度账本并清空请求缓存，所有期刊重新抓取")
+    args = parser.parse_args()
+    main(workers=args.workers, out_dir=args.out, base_url=args.base_url,
+         use_cache=not args.no_cache, restart=args.restart)
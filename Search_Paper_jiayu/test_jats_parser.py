@@ -0,0 +1,28 @@
+import io
+
+from jats_parser import parse_jats
+
+ARTICLE = b"""<article><front><article-meta>
+<article-id pub-id-type="pmid">123</article-id>
+<title-group><article-title>A <italic>test</italic> article</article-title></title-group>
+</article-meta></front>
+<body><sec><title>Results</title>
+<p>Water (H<sub>2</sub>O) was heated<disp-formula>E = mc2</disp-formula>to 80 C.</p>
+<fig><label>Figure 1</label><caption><title>Cap title</title><p>tab cap</p></caption></fig>
+</sec></body></article>"""
+
+
+def sections():
+    return {s.section_type: s for s in parse_jats(io.BytesIO(ARTICLE))}
+
+
+def test_caption_title_and_paragraph_are_separated():
+    fig = sections()["figure"]
+    assert fig.title == "Figure 1"
+    assert fig.text == "Cap title tab cap"
+
+
+def test_inline_markup_stays_joined_block_children_do_not():
+    results = sections()["results"]
+    assert results.text == "Water (H2O) was heated E = mc2 to 80 C."
+    assert results.article_title == "A test article"
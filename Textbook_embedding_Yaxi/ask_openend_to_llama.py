@@ -1,11 +1,15 @@
+import argparse
 import json
-import csv
-import subprocess
 
-from paths import OPEN_ENDED_BANK_JSON, OUTPUTS_DIR, fetch_rag_context
+from paths import OPEN_ENDED_BANK_JSON, OUTPUTS_DIR
+from llm_backends import get_backend, set_cache_enabled
+from llm_cache import print_cache_stats
+from instrumentation import finish_trace, span, start_trace, traced
+from runner import ResultWriter, call_with_backoff, run_in_order
 
-def ask_llm_open_ended(question, context):
-    prompt = f"""You are a knowledgeable assistant in the field of biomaterials.
+def ask_llm_open_ended(question):
+    with span("prompt"):
+        prompt = f"""You are a knowledgeable assistant in the field of biomaterials.
 
 QUESTION:
 {question}
@@ -13,51 +17,65 @@ QUESTION:
 Answer the question clearly and directly, with no extra commentary, internal thoughts, or preambles. Please limit your answer to 400 words.
 """
     try:
-        proc = subprocess.run(
-            ["ollama", "run", "llama3"],
-            input=prompt,
-            text=True,
-            capture_output=True,
-            check=True
-        )
-        return proc.stdout.strip()
-    except subprocess.CalledProcessError as e:
+        backend = get_backend("ollama", "llama3")
+        return call_with_backoff(backend.traced_generate, prompt, retries=3).strip()
+    except Exception as e:
         print("Error calling LLM:", e)
         return ""
 
-def main():
+def answer_question(item):
+    q_text = item["question"]
+
+    # 1) Query the model (no retrieved context in this series)
+    llm_answer = ask_llm_open_ended(q_text)
+
+    return {
+        "id": item["id"],
+        "unit": item.get("unit", ""),
+        "part": item.get("part", ""),
+        "number": item.get("number", ""),
+        "question": q_text,
+        "llm_answer": llm_answer
+    }
+
+def main(workers: int = 1, resume: bool = False):
     with open(OPEN_ENDED_BANK_JSON, "r", encoding="utf-8") as f:
         questions = json.load(f)
 
+    start_trace("open_qa_with_llm_withoutRAG", backend="ollama", model="llama3", workers=workers)
     out_path = OUTPUTS_DIR / "open_qa_with_llm_withoutRAG.csv"
-    with open(out_path, "w", newline="", encoding="utf-8") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=[
-            "id", "unit", "part", "number", "question", "llm_answer"
-        ])
-        writer.writeheader()
-
-        for item in questions:
-            q_text = item["question"]
-
-            # 1) RAG context
-            ctx = fetch_rag_context(q_text)
-
-            # 2) Query the model
-            llm_answer = ask_llm_open_ended(q_text, ctx)
-
-            # 3) Write to CSV
-            writer.writerow({
-                "id": item["id"],
-                "unit": item.get("unit", ""),
-                "part": item.get("part", ""),
-                "number": item.get("number", ""),
-                "question": q_text,
-                "llm_answer": llm_answer
-            })
-
+    fieldnames = [
+        "id", "unit", "part", "number", "question", "llm_answer"
+    ]
+    with ResultWriter(out_path, fieldnames, resume=resume,
+                      is_valid=lambda row: bool((row.get("llm_answer") or "").strip())) as writer:
+        if writer.done_ids:
+            print(f"⏩ Resuming: {len(writer.done_ids)} questions already answered")
+        todo = [item for item in questions if item["id"] not in writer.done_ids]
+        # 2) Write to CSV in question order
+        def write_row(item, row):
+            writer.writerow(row)
             print(f"Q{item['number']} → answer written")
 
+        run_in_order(
+            todo,
+            traced(answer_question),
+            max_workers=workers,
+            on_result=write_row,
+        )
+
     print(f"✅ Saved results to {out_path}")
+    print_cache_stats()
+    finish_trace()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1,
+                        help="max Ollama requests in flight (see OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always call the model, bypassing the LLM response cache")
+    parser.add_argument("--resume", action="store_true",
+                        help="keep valid rows of an existing output file and only ask the rest")
+    args = parser.parse_args()
+    set_cache_enabled(not args.no_cache)
+    main(args.workers, args.resume)
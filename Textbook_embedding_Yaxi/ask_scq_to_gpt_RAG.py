@@ -1,20 +1,23 @@
+import argparse
 import re
 import json
-import csv
-import subprocess
 import os
-import time
 import unicodedata
-from openai import OpenAI
 import sys
-import io
 
-from paths import OUTPUTS_DIR, SCQ_BANK_JSON, fetch_rag_context
+from paths import OUTPUTS_DIR, SCQ_BANK_JSON, fetch_rag_context, fetch_rag_contexts
+from context_builder import configure_context
+from llm_backends import (CONSTRAINED_FORMAT, NO_CHOICE, OPTION_LETTERS, format_confidence,
+                          get_backend, set_cache_enabled)
+from llm_cache import print_cache_stats
+from instrumentation import finish_trace, span, start_trace, traced
+from runner import ResultWriter, call_with_backoff, run_in_order
 
-# Force stdout/stderr encoding to UTF-8
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
-os.environ["PYTHONIOENCODING"] = "utf-8"
+def force_utf8_stdio():
+    """Force stdout/stderr encoding to UTF-8 (only when run as a script)."""
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+    os.environ["PYTHONIOENCODING"] = "utf-8"
 
 def clean_text(text: str) -> str:
     # 1) Normalize to NFKC
@@ -25,9 +28,6 @@ def clean_text(text: str) -> str:
     # 3) Strip out any character above U+007F
     return text.encode("ascii", "ignore").decode("ascii")
 
-# Initialize OpenAI client
-client = OpenAI()  # API key should be set via OPENAI_API_KEY env variable
-
 def normalize_unicode(text):
     """Normalize Unicode text to avoid smart quote and encoding issues."""
     return unicodedata.normalize("NFKC", text)
@@ -36,16 +36,36 @@ def fetch_context(query):
     query = clean_text(query)
     try:
         return clean_text(fetch_rag_context(query))
-    except subprocess.CalledProcessError as e:
+    except Exception as e:
         print(f"❌ Error fetching context: {e}")
         return ""
 
-def ask_llm(question_with_opts: str, context: str, retries: int = 3) -> str:
+def fetch_contexts(questions):
+    """Batched ``fetch_context`` for a whole bank, keyed by question id."""
+    queries = {item["id"]: clean_text(item["question"]) for item in questions}
+    try:
+        contexts = fetch_rag_contexts(queries)
+    except Exception as e:
+        print(f"❌ Error fetching contexts: {e}")
+        return {qid: "" for qid in queries}
+    return {qid: clean_text(ctx) for qid, ctx in contexts.items()}
+
+ANSWER_FORMAT = """Please provide:
+The best single-choice option (a, b, c, or d). You must choose one of the options.
+No explanation needed.
+
+Format:
+1. <option> (a, b, c, or d, without any other text)
+"""
+
+def ask_llm(question_with_opts: str, context: str, retries: int = 5,
+            constrained: bool = False):
     # Clean both question and context one last time
     question_with_opts = clean_text(question_with_opts)
     context = clean_text(context)
 
-    prompt = f"""You are a biomaterials assistant.
+    with span("prompt"):
+        prompt = f"""You are a biomaterials assistant.
 
 CONTEXT:
 {context}
@@ -53,13 +73,7 @@ CONTEXT:
 QUESTION:
 {question_with_opts}
 
-Please provide:
-The best single-choice option (a, b, c, or d). You must choose one of the options.
-No explanation needed.
-
-Format:
-1. <option> (a, b, c, or d, without any other text)
-"""
+{CONSTRAINED_FORMAT if constrained else ANSWER_FORMAT}"""
     # Clean the final prompt to strip any accidental non-ASCII
     prompt = clean_text(prompt)
 
@@ -72,25 +86,30 @@ Format:
     print(prompt)
     print("-" * 40)
 
-    for attempt in range(retries):
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system",  "content": clean_text("You are a biomaterials assistant.")},
-                    {"role": "user",    "content": prompt}
-                ],
-                temperature=0
+    backend = get_backend("openai", "gpt-4o")
+    try:
+        if constrained:
+            return call_with_backoff(
+                backend.traced_choose,
+                prompt,
+                OPTION_LETTERS,
+                system=clean_text("You are a biomaterials assistant."),
+                temperature=0,
+                retries=retries,
             )
-            # The API will return a string in response.choices[0].message.content
-            return response.choices[0].message.content
-
-        except Exception as e:
-            print(f"⚠️ GPT-4o call failed (attempt {attempt+1}): {e}")
-            time.sleep(2)
-
-    # If all retries fail, return an empty string
-    return ""
+        return call_with_backoff(
+            backend.traced_generate,
+            prompt,
+            system=clean_text("You are a biomaterials assistant."),
+            temperature=0,
+            retries=retries,
+        )
+    except Exception as e:
+        # If all retries fail, return an empty answer
+        print(f"⚠️ GPT-4o call failed after {retries} attempts: {e}")
+        return NO_CHOICE if constrained else ""
+
+VALID_OPTIONS = set(OPTION_LETTERS)
 
 def parse_response(resp_text):
     lines = [ln.strip() for ln in resp_text.splitlines() if ln.strip()]
@@ -106,56 +125,101 @@ def parse_response(resp_text):
             match = re.search(r"\b([a-dA-D])\b", ln)
             option = match.group(1).lower()
 
-    if option not in {"a", "b", "c", "d"}:
+    if option not in VALID_OPTIONS:
         option = ""
     return option, explanation
 
-def main():
-    with open(SCQ_BANK_JSON, "r", encoding="utf-8") as f:
-        questions = json.load(f)
-
-    out_path = OUTPUTS_DIR / "scq_with_gpt_withRAG.csv"
-    with open(out_path, "w", newline="", encoding="utf-8") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=[
-            "id", "section", "number", "question",
-            "correct_answer", "predicted_option", "explanation"
-        ])
-        writer.writeheader()
-
-        for item in questions:
-            q_text = clean_text(item["question"])
-            opts = item["options"]
-            opts_lines = "\n".join(f"{letter}) {clean_text(text)}"
-                                for letter, text in sorted(opts.items()))
-            q_block = f"{q_text}\n{opts_lines}"
-
-            print(f"🔍 Received query: '{q_text}'")
-
-            ctx = fetch_context(q_text)
-            if not ctx.strip():
-                print(f"⚠️ No context found for Q{item['number']}")
-
-            
-            resp = ask_llm(q_block, ctx)
+def answer_question(item, ctx, constrained=False):
+    q_text = clean_text(item["question"])
+    opts = item["options"]
+    opts_lines = "\n".join(f"{letter}) {clean_text(text)}"
+                        for letter, text in sorted(opts.items()))
+    q_block = f"{q_text}\n{opts_lines}"
+
+    print(f"🔍 Received query: '{q_text}'")
+
+    if not ctx.strip():
+        print(f"⚠️ No context found for Q{item['number']}")
+
+    confidence = None
+    if constrained:
+        result = ask_llm(q_block, ctx, constrained=True)
+        pred_opt, exp, confidence = result["choice"], "", result["probs"]
+    else:
+        resp = ask_llm(q_block, ctx)
+        with span("parse"):
             pred_opt, exp = parse_response(resp)
 
-            if not pred_opt:
-                print(f"⚠️ Warning: No valid prediction for Q{item['number']}")
-                pred_opt = "?"
-
-            writer.writerow({
-                "id":               item["id"],
-                "section":          item.get("section", ""),
-                "number":           item.get("number", ""),
-                "question":         q_text,
-                "correct_answer":   item.get("answer", ""),
-                "predicted_option": pred_opt,
-                "explanation":      exp
-            })
+    if not pred_opt:
+        print(f"⚠️ Warning: No valid prediction for Q{item['number']}")
+        pred_opt = "?"
+
+    row = {
+        "id":               item["id"],
+        "section":          item.get("section", ""),
+        "number":           item.get("number", ""),
+        "question":         q_text,
+        "correct_answer":   item.get("answer", ""),
+        "predicted_option": pred_opt,
+        "explanation":      exp
+    }
+    if constrained:
+        row["confidence"] = format_confidence(confidence)
+    return row
+
+def main(workers: int = 16, resume: bool = False, constrained: bool = False):
+    with open(SCQ_BANK_JSON, "r", encoding="utf-8") as f:
+        questions = json.load(f)
 
-            print(f"Q{item['number']} → predicted {pred_opt}, actual {item.get('answer')}")
+    name = "scq_with_gpt_withRAG_constrained" if constrained else "scq_with_gpt_withRAG"
+    start_trace(name, backend="openai", model="gpt-4o", workers=workers,
+                answer_mode="constrained" if constrained else "generate")
+    out_path = OUTPUTS_DIR / f"{name}.csv"
+    fieldnames = [
+        "id", "section", "number", "question",
+        "correct_answer", "predicted_option", "explanation"
+    ] + (["confidence"] if constrained else [])
+    with ResultWriter(out_path, fieldnames, resume=resume,
+                      is_valid=lambda row: row.get("predicted_option") in VALID_OPTIONS) as writer:
+        if writer.done_ids:
+            print(f"⏩ Resuming: {len(writer.done_ids)} questions already answered")
+        todo = [item for item in questions if item["id"] not in writer.done_ids]
+        contexts = fetch_contexts(todo)
+
+        def write_row(item, row):
+            writer.writerow(row)
+            print(f"Q{item['number']} → predicted {row['predicted_option']}, actual {item.get('answer')}")
+
+        run_in_order(
+            todo,
+            traced(lambda item: answer_question(item, contexts[item["id"]], constrained)),
+            max_workers=workers,
+            on_result=write_row,
+        )
 
     print(f"✅ Saved results to {out_path}")
+    print_cache_stats()
+    finish_trace()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=16,
+                        help="max GPT-4o requests in flight")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always call the model, bypassing the LLM response cache")
+    parser.add_argument("--resume", action="store_true",
+                        help="keep valid rows of an existing output file and only ask the rest")
+    parser.add_argument("--full-context", action="store_true",
+                        help="paste the top-k chunks unchanged instead of the token-budgeted context")
+    parser.add_argument("--context-tokens", type=int,
+                        help="context token budget (default $RAG_CONTEXT_TOKENS or 1000)")
+    parser.add_argument("--chunk-tokens", type=int,
+                        help="max tokens kept per chunk (default $RAG_CHUNK_TOKENS or 350)")
+    parser.add_argument("--constrained", action="store_true",
+                        help="answer with a single option token (max_tokens=1) and record "
+                             "the a-d probabilities from its logprobs")
+    args = parser.parse_args()
+    force_utf8_stdio()
+    set_cache_enabled(not args.no_cache)
+    configure_context("full" if args.full_context else None, args.context_tokens, args.chunk_tokens)
+    main(args.workers, args.resume, args.constrained)
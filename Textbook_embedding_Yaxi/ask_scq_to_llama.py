@@ -1,13 +1,27 @@
+import argparse
 import re
 import json
-import csv
 import uuid
-import subprocess
 
-from paths import OUTPUTS_DIR, SCQ_BANK_JSON, fetch_rag_context
+from paths import OUTPUTS_DIR, SCQ_BANK_JSON, fetch_rag_contexts
+from context_builder import configure_context
+from llm_backends import (CONSTRAINED_FORMAT, NO_CHOICE, OPTION_LETTERS, format_confidence,
+                          get_backend, set_cache_enabled)
+from llm_cache import print_cache_stats
+from instrumentation import finish_trace, span, start_trace, traced
+from runner import ResultWriter, call_with_backoff, run_in_order
 
-def ask_llm(question_with_opts, context):
-    prompt = f"""You are a biomaterials assistant.
+ANSWER_FORMAT = """Please provide:
+The best single-choice option (a, b, c, or d). You must choose one of the options.
+No explanation needed.
+
+Format:
+1. <option> (a, b, c, or d, without any other text)
+"""
+
+def ask_llm(question_with_opts, context, constrained=False):
+    with span("prompt"):
+        prompt = f"""You are a biomaterials assistant.
 
 Context (optional):
 {context}
@@ -15,25 +29,17 @@ Context (optional):
 QUESTION:
 {question_with_opts}
 
-Please provide:
-The best single-choice option (a, b, c, or d). You must choose one of the options.
-No explanation needed.
-
-Format:
-1. <option> (a, b, c, or d, without any other text)
-"""
+{CONSTRAINED_FORMAT if constrained else ANSWER_FORMAT}"""
     try:
-        proc = subprocess.run(
-            ["ollama", "run", "qwen3"],
-            input=prompt,
-            text=True,
-            capture_output=True,
-            check=True
-        )
-        return proc.stdout
-    except subprocess.CalledProcessError as e:
+        backend = get_backend("ollama", "qwen3")
+        if constrained:
+            return call_with_backoff(backend.traced_choose, prompt, OPTION_LETTERS, retries=3)
+        return call_with_backoff(backend.traced_generate, prompt, retries=3)
+    except Exception as e:
         print("Error calling LLM:", e)
-        return ""
+        return NO_CHOICE if constrained else ""
+
+VALID_OPTIONS = set(OPTION_LETTERS)
 
 def parse_response(resp_text):
     lines = [ln.strip() for ln in resp_text.splitlines() if ln.strip()]
@@ -50,55 +56,97 @@ def parse_response(resp_text):
             match = re.search(r"\b([a-dA-D])\b", ln)
             option = match.group(1).lower()
 
-    if option not in {"a", "b", "c", "d"}:
+    if option not in VALID_OPTIONS:
         option = ""  # fallback if not found
     return option, explanation
 
-def main():
-    with open(SCQ_BANK_JSON, "r", encoding="utf-8") as f:
-        questions = json.load(f)
-
-    out_path = OUTPUTS_DIR / "scq_with_llm_withoutRAG.csv"
-    with open(out_path, "w", newline="", encoding="utf-8") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=[
-            "id", "section", "number", "question",
-            "correct_answer", "predicted_option", "explanation"
-        ])
-        writer.writeheader()
-
-        for item in questions:
-            q_text = item["question"]
-            opts = item["options"]
-            opts_lines = "\n".join(f"{letter}) {text}" for letter, text in sorted(opts.items()))
-            q_block = f"{q_text}\n{opts_lines}"
-
-            # 1) RAG context
-            ctx = fetch_rag_context(q_text)
-
-            # 2) Query the model
-            resp = ask_llm(q_block, ctx)
-
-            # 3) Extract predicted option
+def answer_question(item, ctx, constrained=False):
+    q_text = item["question"]
+    opts = item["options"]
+    opts_lines = "\n".join(f"{letter}) {text}" for letter, text in sorted(opts.items()))
+    q_block = f"{q_text}\n{opts_lines}"
+
+    # 2) Query the model and 3) extract the predicted option
+    confidence = None
+    if constrained:
+        result = ask_llm(q_block, ctx, constrained=True)
+        pred_opt, exp, confidence = result["choice"], "", result["probs"]
+    else:
+        resp = ask_llm(q_block, ctx)
+        with span("parse"):
             pred_opt, exp = parse_response(resp)
 
-            if not pred_opt:
-                print(f"⚠️ Warning: No valid prediction for Q{item['number']}")
-                pred_opt = "?"
-
-            # 4) Write CSV row
-            writer.writerow({
-                "id":               item["id"],
-                "section":          item.get("section", ""),
-                "number":           item.get("number", ""),
-                "question":         q_text,
-                "correct_answer":   item.get("answer", ""),
-                "predicted_option": pred_opt,
-                "explanation":      exp
-            })
+    if not pred_opt:
+        print(f"⚠️ Warning: No valid prediction for Q{item['number']}")
+        pred_opt = "?"
+
+    row = {
+        "id":               item["id"],
+        "section":          item.get("section", ""),
+        "number":           item.get("number", ""),
+        "question":         q_text,
+        "correct_answer":   item.get("answer", ""),
+        "predicted_option": pred_opt,
+        "explanation":      exp
+    }
+    if constrained:
+        row["confidence"] = format_confidence(confidence)
+    return row
+
+def main(workers: int = 1, resume: bool = False, constrained: bool = False):
+    with open(SCQ_BANK_JSON, "r", encoding="utf-8") as f:
+        questions = json.load(f)
 
-            print(f"Q{item['number']} → predicted {pred_opt}, actual {item.get('answer')}")
+    name = "scq_with_llm_withoutRAG_constrained" if constrained else "scq_with_llm_withoutRAG"
+    start_trace(name, backend="ollama", model="qwen3", workers=workers,
+                answer_mode="constrained" if constrained else "generate")
+    out_path = OUTPUTS_DIR / f"{name}.csv"
+    fieldnames = [
+        "id", "section", "number", "question",
+        "correct_answer", "predicted_option", "explanation"
+    ] + (["confidence"] if constrained else [])
+    with ResultWriter(out_path, fieldnames, resume=resume,
+                      is_valid=lambda row: row.get("predicted_option") in VALID_OPTIONS) as writer:
+        if writer.done_ids:
+            print(f"⏩ Resuming: {len(writer.done_ids)} questions already answered")
+        todo = [item for item in questions if item["id"] not in writer.done_ids]
+        # 1) RAG context for the whole bank up front in one batched search
+        contexts = fetch_rag_contexts({item["id"]: item["question"] for item in todo})
+
+        # 4) Write CSV rows in question order
+        def write_row(item, row):
+            writer.writerow(row)
+            print(f"Q{item['number']} → predicted {row['predicted_option']}, actual {item.get('answer')}")
+
+        run_in_order(
+            todo,
+            traced(lambda item: answer_question(item, contexts[item["id"]], constrained)),
+            max_workers=workers,
+            on_result=write_row,
+        )
 
     print(f"Saved results to {out_path}")
+    print_cache_stats()
+    finish_trace()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1,
+                        help="max Ollama requests in flight (see OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always call the model, bypassing the LLM response cache")
+    parser.add_argument("--resume", action="store_true",
+                        help="keep valid rows of an existing output file and only ask the rest")
+    parser.add_argument("--full-context", action="store_true",
+                        help="paste the top-k chunks unchanged instead of the token-budgeted context")
+    parser.add_argument("--context-tokens", type=int,
+                        help="context token budget (default $RAG_CONTEXT_TOKENS or 1000)")
+    parser.add_argument("--chunk-tokens", type=int,
+                        help="max tokens kept per chunk (default $RAG_CHUNK_TOKENS or 350)")
+    parser.add_argument("--constrained", action="store_true",
+                        help="answer with one grammar-constrained option letter and record "
+                             "the a-d probabilities (when the server returns logprobs)")
+    args = parser.parse_args()
+    set_cache_enabled(not args.no_cache)
+    configure_context("full" if args.full_context else None, args.context_tokens, args.chunk_tokens)
+    main(args.workers, args.resume, args.constrained)
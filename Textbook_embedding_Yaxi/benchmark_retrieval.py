@@ -0,0 +1,255 @@
+"""Retrieval latency / throughput / recall benchmark for the FAISS indexes.
+
+Uses the SCQ and open-ended question banks as query workloads and reports,
+per index:
+
+* load time per component (model, index, metadata) and RSS before/after,
+  for any encoder backend (``--backend onnx-int8``)
+* single-query latency p50/p95/p99, split into encode / search / lookup
+* queries per second of ``search_batch`` at several batch sizes
+* recall@k of the index against exact flat search over the same vectors
+* optionally, build time, search latency and recall of other index types
+  built from the same vectors (``--compare hnsw,ivf``)
+
+Results are written as JSON (tagged with the git commit) so runs can be
+diffed across commits:
+
+    python Textbook_embedding_Yaxi/benchmark_retrieval.py --index textbook --compare hnsw,ivf
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, List, Optional, Sequence
+
+from encoders import BACKENDS
+from index_factory import INDEX_TYPES, build_index, recall_at_k
+from metadata_store import chunk_store_exists
+from paths import (ABSTRACTS_FAISS_INDEX, ABSTRACTS_METADATA_STORE, FAISS_INDEX,
+                   METADATA_STORE, MODULE_DIR, OPEN_ENDED_BANK_JSON, OUTPUTS_DIR,
+                   SCQ_BANK_JSON)
+from retriever import MODEL_NAME, FaissRetriever
+
+INDEXES = {
+    "textbook": (FAISS_INDEX, METADATA_STORE, MODEL_NAME),
+    "abstracts": (ABSTRACTS_FAISS_INDEX, ABSTRACTS_METADATA_STORE,
+                  "maidalun1020/bce-embedding-base_v1"),
+}
+WORKLOADS = {"scq": SCQ_BANK_JSON, "open_ended": OPEN_ENDED_BANK_JSON}
+BATCH_SIZES = (1, 8, 32, 128)
+DEFAULT_K = 5
+RECALL_K = 10
+WARMUP = 5
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size (peak RSS where /proc is unavailable,
+    ``None`` on platforms without either, e.g. Windows)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource  # POSIX only
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=MODULE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_queries(path) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [item["question"].strip() for item in json.load(f) if item.get("question", "").strip()]
+
+
+def percentiles(samples_s: Sequence[float]) -> Dict[str, float]:
+    import numpy as np
+
+    ms = np.asarray(samples_s) * 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+            "mean_ms": float(ms.mean()), "n": int(len(ms))}
+
+
+def index_vectors(index):
+    """``(vectors, ids)`` stored in ``index``; ``ids`` is ``None`` without an id map."""
+    import faiss
+
+    ids = None
+    base = index
+    if hasattr(index, "id_map"):
+        ids = faiss.vector_to_array(index.id_map).astype("int64")
+        base = faiss.downcast_index(index.index)
+    if hasattr(base, "make_direct_map"):  # IVF indexes cannot reconstruct without it
+        base.make_direct_map()
+    return base.reconstruct_n(0, base.ntotal), ids
+
+
+def index_kind(index) -> str:
+    import faiss
+
+    base = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    return type(base).__name__
+
+
+def bench_latency(retriever: FaissRetriever, queries: Sequence[str], k: int) -> Dict:
+    """Per-query latency, timed per stage exactly as ``search_batch`` runs them."""
+    import numpy as np
+
+    for q in queries[:WARMUP]:
+        retriever.search(q, k)
+    stages = {"encode": [], "search": [], "lookup": [], "total": []}
+    for q in queries:
+        t0 = time.perf_counter()
+        emb = retriever.model.encode([q])
+        t1 = time.perf_counter()
+        D, I = retriever.index.search(np.asarray(emb, dtype="float32"), k)
+        t2 = time.perf_counter()
+        retriever._hits(D[0], I[0])
+        t3 = time.perf_counter()
+        stages["encode"].append(t1 - t0)
+        stages["search"].append(t2 - t1)
+        stages["lookup"].append(t3 - t2)
+        stages["total"].append(t3 - t0)
+    return {stage: percentiles(samples) for stage, samples in stages.items()}
+
+
+def bench_throughput(retriever: FaissRetriever, queries: Sequence[str], k: int,
+                     batch_sizes: Sequence[int], repeat: int) -> Dict[str, float]:
+    qps = {}
+    workload = list(queries) * repeat
+    for bs in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(workload), bs):
+            retriever.search_batch(workload[i:i + bs], k)
+        qps[str(bs)] = len(workload) / (time.perf_counter() - start)
+    return qps
+
+
+def bench_index(index, vectors, query_vectors, ids, k: int) -> Dict:
+    """Search-only latency and recall@k of ``index`` for pre-encoded queries."""
+    latencies = []
+    for i in range(len(query_vectors)):
+        start = time.perf_counter()
+        index.search(query_vectors[i:i + 1], k)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "search": percentiles(latencies),
+        f"recall@{RECALL_K}": recall_at_k(index, vectors, k=RECALL_K,
+                                          queries=query_vectors, ids=ids),
+    }
+
+
+def run(name: str, workloads: Sequence[str], k: int = DEFAULT_K,
+        batch_sizes: Sequence[int] = BATCH_SIZES, repeat: int = 3,
+        compare: Sequence[str] = (), backend: Optional[str] = None) -> Dict:
+    import numpy as np
+
+    index_path, metadata_path, model_name = INDEXES[name]
+    if not index_path.exists():
+        raise FileNotFoundError(f"No {name} index at {index_path}")
+    if not chunk_store_exists(metadata_path) and name != "textbook":
+        # only the textbook index has a legacy CSV; never benchmark against it
+        raise FileNotFoundError(f"No {name} chunk store at {metadata_path}.jsonl; "
+                                f"build it before benchmarking this index")
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    retriever = FaissRetriever(index_path, metadata_path, model_name, backend=backend)
+    load_total = time.perf_counter() - start
+    rss_after = rss_bytes()
+    kind = index_kind(retriever.index)
+    print(f"📦 Loaded {name} ({kind}, {retriever.index.ntotal} vectors) in {load_total:.2f}s")
+
+    vectors, ids = index_vectors(retriever.index)
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "index": {"name": name, "path": str(index_path), "type": kind,
+                  "ntotal": int(retriever.index.ntotal), "dim": int(retriever.index.d),
+                  "model": model_name, "encoder": retriever.model.backend},
+        "k": k,
+        "load": {"total_s": load_total,
+                 **{f"{part}_s": secs for part, secs in retriever.load_times.items()},
+                 "rss_before_bytes": rss_before, "rss_after_bytes": rss_after},
+        "workloads": {},
+    }
+
+    candidates = {}
+    for candidate in compare:
+        start = time.perf_counter()
+        candidates[candidate] = build_index(candidate, vectors, ids=ids)
+        report.setdefault("compare_build_s", {})[candidate] = time.perf_counter() - start
+
+    for workload in workloads:
+        queries = load_queries(WORKLOADS[workload])
+        print(f"⏱️  {workload}: {len(queries)} queries")
+        query_vectors = np.asarray(retriever.model.encode(queries), dtype="float32")
+        result = {
+            "n_queries": len(queries),
+            "latency": bench_latency(retriever, queries, k),
+            "qps_by_batch_size": bench_throughput(retriever, queries, k, batch_sizes, repeat),
+            f"recall@{RECALL_K}": recall_at_k(retriever.index, vectors, k=RECALL_K,
+                                              queries=query_vectors, ids=ids),
+            # PQ indexes only reconstruct approximate vectors, so their
+            # "exact" ground truth is itself approximate
+            "recall_truth_exact": "PQ" not in kind,
+        }
+        if candidates:
+            result["compare"] = {candidate: bench_index(index, vectors, query_vectors, ids, k)
+                                 for candidate, index in candidates.items()}
+        report["workloads"][workload] = result
+        lat = result["latency"]["total"]
+        print(f"   p50 {lat['p50_ms']:.2f} ms, p95 {lat['p95_ms']:.2f} ms, p99 {lat['p99_ms']:.2f} ms, "
+              f"recall@{RECALL_K} {result[f'recall@{RECALL_K}']:.3f}")
+        for bs, qps in result["qps_by_batch_size"].items():
+            print(f"   batch {bs:>4}: {qps:.1f} queries/sec")
+        for candidate, stats in result.get("compare", {}).items():
+            print(f"   {candidate:>6}: search p50 {stats['search']['p50_ms']:.3f} ms, "
+                  f"recall@{RECALL_K} {stats[f'recall@{RECALL_K}']:.3f}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--index", choices=sorted(INDEXES), default="textbook")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS) + ["all"], default="all")
+    parser.add_argument("-k", type=int, default=DEFAULT_K)
+    parser.add_argument("--batch-sizes", default=",".join(map(str, BATCH_SIZES)))
+    parser.add_argument("--repeat", type=int, default=3, help="workload repetitions for the QPS runs")
+    parser.add_argument("--compare", default="",
+                        help=f"comma-separated index types to build and compare ({', '.join(INDEX_TYPES)})")
+    parser.add_argument("--backend", choices=BACKENDS, help="encoder backend (default $ENCODER_BACKEND)")
+    parser.add_argument("--out", help="JSON output path (default outputs/benchmarks/...)")
+    args = parser.parse_args()
+
+    workloads = sorted(WORKLOADS) if args.workload == "all" else [args.workload]
+    compare = [c for c in args.compare.split(",") if c]
+    report = run(args.index, workloads, k=args.k,
+                 batch_sizes=[int(b) for b in args.batch_sizes.split(",")],
+                 repeat=args.repeat, compare=compare, backend=args.backend)
+
+    out = args.out or os.path.join(
+        OUTPUTS_DIR, "benchmarks",
+        f"retrieval_{args.index}_{report['commit'] or time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Benchmark written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Cold-start benchmark: ``python -X importtime`` per entry-point module.
+
+Each module is imported in a fresh interpreter. The report gives wall time
+(minus bare interpreter startup), the module's cumulative import time, the
+slowest imported packages, and which heavy dependencies (torch, faiss,
+pandas, ...) the import pulled in -- for a side-effect-free module that
+list should be empty. ``--cli`` also times ``search_faiss.py`` end to end,
+which is fast when the retrieval daemon or cache can answer.
+
+    python Textbook_embedding_Yaxi/benchmark_startup.py --cli
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from benchmark_retrieval import git_commit
+from paths import MODULE_DIR, OUTPUTS_DIR, REPO_ROOT
+
+MODULES = [
+    (MODULE_DIR, "paths"),
+    (MODULE_DIR, "search_faiss"),
+    (MODULE_DIR, "retriever"),
+    (MODULE_DIR, "retrieval_server"),
+    (MODULE_DIR, "encoders"),
+    (MODULE_DIR, "llm_backends"),
+    (MODULE_DIR, "textbook_embedding"),
+    (MODULE_DIR, "ask_scq_to_gpt_RAG"),
+    (MODULE_DIR, "ask_scq_to_llama_RAG"),
+    (MODULE_DIR, "ask_openend_to_llama_RAG"),
+    (MODULE_DIR, "benchmark_retrieval"),
+    (REPO_ROOT / "Search_Paper_jiayu", "embedding_abstracts"),
+]
+HEAVY = ("torch", "sentence_transformers", "transformers", "faiss", "numpy", "pandas",
+         "fitz", "onnxruntime", "openai", "ollama", "docx", "Bio")
+CLI_QUERY = "What is a hydrogel?"
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def wall_ms(cmd: List[str], cwd) -> Tuple[float, subprocess.CompletedProcess]:
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=str(cwd), capture_output=True, text=True)
+    return (time.perf_counter() - start) * 1000.0, proc
+
+
+def interpreter_ms(repeat: int) -> float:
+    return min(wall_ms([sys.executable, "-c", "pass"], MODULE_DIR)[0] for _ in range(repeat))
+
+
+def import_profile(cwd, module: str, repeat: int = 3, top: int = 8) -> Dict:
+    """Best-of-``repeat`` import of ``module`` in a fresh interpreter."""
+    runs = [wall_ms([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd)
+            for _ in range(repeat)]
+    elapsed, proc = min(runs, key=lambda run: run[0])
+    if proc.returncode != 0:
+        lines = [l for l in proc.stderr.splitlines() if not l.startswith("import time:")]
+        return {"ok": False, "wall_ms": elapsed, "error": lines[-1] if lines else "failed"}
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent)))
+    names = {name for name, *_ in entries}
+    slowest: Dict[str, int] = {}
+    for name, _, cumulative_us, _ in entries:
+        root = name.split(".")[0]
+        if root != module:
+            slowest[root] = max(slowest.get(root, 0), cumulative_us)
+    return {
+        "ok": True,
+        "wall_ms": elapsed,
+        "import_ms": next((c for n, _, c, _ in entries if n == module), 0) / 1000.0,
+        "modules_imported": len(entries),
+        "heavy_loaded": [h for h in HEAVY if h in names],
+        "slowest": {name: us / 1000.0 for name, us in
+                    sorted(slowest.items(), key=lambda kv: -kv[1])[:top]},
+    }
+
+
+def cli_profile(repeat: int, query: str = CLI_QUERY) -> Dict:
+    runs = [wall_ms([sys.executable, "search_faiss.py", query], MODULE_DIR) for _ in range(repeat)]
+    times = [ms for ms, _ in runs]
+    return {"command": f'search_faiss.py "{query}"', "ok": all(p.returncode == 0 for _, p in runs),
+            "min_ms": min(times), "median_ms": statistics.median(times)}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cli", action="store_true", help="also time search_faiss.py end to end")
+    parser.add_argument("--out", help="JSON output path (default outputs/benchmarks/...)")
+    args = parser.parse_args(argv)
+
+    base = interpreter_ms(args.repeat)
+    report = {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": sys.version.split()[0], "interpreter_ms": base, "modules": {}}
+    print(f"🐍 Bare interpreter startup: {base:.0f} ms")
+    for cwd, module in MODULES:
+        result = import_profile(cwd, module, args.repeat)
+        report["modules"][module] = result
+        if not result["ok"]:
+            print(f"❌ {module:<26} {result['error']}")
+            continue
+        heavy = ", ".join(result["heavy_loaded"]) or "-"
+        print(f"📦 {module:<26} {result['wall_ms'] - base:7.0f} ms  heavy: {heavy}")
+    if args.cli:
+        report["cli"] = cli_profile(args.repeat)
+        cli = report["cli"]
+        print(f"⏱️  {cli['command']}: median {cli['median_ms']:.0f} ms (ok: {cli['ok']})")
+
+    out = args.out or os.path.join(
+        OUTPUTS_DIR, "benchmarks", f"startup_{report['commit'] or time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Startup report written to {out}")
+
+
+if __name__ == "__main__":
+    main()
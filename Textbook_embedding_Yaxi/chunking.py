@@ -0,0 +1,163 @@
+"""Linear-time text chunking shared by the textbook and abstract indexers.
+
+The chunkers walk character offsets over the original string instead of
+re-slicing the remaining text after every chunk, so chunking a whole book
+is O(n) rather than O(n^2). Every chunk records its character span and,
+when page start offsets are given, the pages it covers.
+
+Strategies:
+
+* ``"sentence"`` -- cut at the last ``.`` before ``max_length`` (the
+  original ``chunk_text`` behaviour, output-identical)
+* ``"tokens"`` -- pack whole sentences up to ``max_tokens`` tokens; a
+  sentence longer than that is cut into ``max_tokens`` windows
+* ``"window"`` -- fixed ``max_length`` windows overlapping by ``overlap``
+"""
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence
+
+SENTENCE_END = re.compile(r"[.!?](?=\s|$)")
+TOKEN = re.compile(r"\S+")
+
+
+@dataclass
+class Chunk:
+    text: str
+    start: int  # char offset of the chunk in the source text
+    end: int
+    page_start: Optional[int] = None  # 1-based, inclusive
+    page_end: Optional[int] = None
+
+
+def count_words(text: str) -> int:
+    return sum(1 for _ in TOKEN.finditer(text))
+
+
+def page_starts_for(pages: Sequence[str], sep: str = "\n") -> List[int]:
+    """Offsets at which each page begins in ``sep.join(pages)``."""
+    starts, offset = [], 0
+    for page in pages:
+        starts.append(offset)
+        offset += len(page) + len(sep)
+    return starts
+
+
+def _stripped_span(text: str, start: int, end: int):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _sentence_chunks(text: str, max_length: int):
+    n = len(text)
+    pos, end = 0, n
+    stripped_end = None
+    while end - pos > max_length:
+        split_idx = text.rfind(".", pos, pos + max_length)
+        if split_idx == -1:
+            split_idx = pos + max_length
+        yield _stripped_span(text, pos, min(split_idx + 1, n))
+        pos = split_idx + 1
+        while pos < n and text[pos].isspace():
+            pos += 1
+        if stripped_end is None:  # the remainder is right-stripped from now on
+            stripped_end = _stripped_span(text, pos, n)[1]
+            end = stripped_end
+    if pos < end:
+        yield pos, end
+
+
+def _token_chunks(text: str, max_tokens: int, count_tokens: Callable[[str], int]):
+    start = cur_end = 0
+    tokens = 0
+    sent_start = 0
+    boundaries = [m.end() for m in SENTENCE_END.finditer(text)]
+    if not boundaries or boundaries[-1] < len(text):
+        boundaries.append(len(text))
+    for sent_end in boundaries:
+        n_tokens = count_tokens(text[sent_start:sent_end])
+        if tokens and tokens + n_tokens > max_tokens:
+            yield _stripped_span(text, start, cur_end)
+            start, tokens = sent_start, 0
+        if n_tokens > max_tokens:
+            # one sentence over the limit (or a run-on table / reference list
+            # with no terminator): emit it as max_tokens-sized windows
+            yield from _split_long(text, sent_start, sent_end, max_tokens, count_tokens)
+            start = cur_end = sent_start = sent_end
+            continue
+        tokens += n_tokens
+        cur_end = sent_end
+        sent_start = sent_end
+    if cur_end > start:
+        yield _stripped_span(text, start, cur_end)
+
+
+def _split_long(text: str, start: int, end: int, max_tokens: int,
+                count_tokens: Callable[[str], int]):
+    """Cut ``text[start:end]`` at word boundaries into spans of at most
+    ``max_tokens`` tokens (a single word over the limit stays whole)."""
+    word_ends = [m.end() for m in TOKEN.finditer(text, start, end)]
+    i = 0
+    while i < len(word_ends):
+        # the longest run of words from i that fits; token counts only grow
+        # as words are added, so binary search for it
+        lo, hi = i, len(word_ends) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if count_tokens(text[start:word_ends[mid]]) <= max_tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        yield _stripped_span(text, start, word_ends[lo])
+        start, i = word_ends[lo], lo + 1
+
+
+def _window_chunks(text: str, max_length: int, overlap: int):
+    n = len(text)
+    step = max(1, max_length - overlap)
+    start = 0
+    while start < n:
+        end = min(start + max_length, n)
+        if end < n:  # prefer not to cut a word in half
+            space = text.rfind(" ", start + step, end)
+            if space != -1:
+                end = space
+        yield _stripped_span(text, start, end)
+        if end >= n:
+            break
+        start = max(start + 1, end - overlap)
+
+
+def chunk_spans(text: str, strategy: str = "sentence", max_length: int = 1000,
+                max_tokens: int = 256, overlap: int = 200,
+                count_tokens: Callable[[str], int] = count_words,
+                page_starts: Optional[Sequence[int]] = None) -> List[Chunk]:
+    """Split ``text`` into :class:`Chunk` objects with offsets and pages."""
+    if strategy == "sentence":
+        spans = _sentence_chunks(text, max_length)
+    elif strategy == "tokens":
+        spans = _token_chunks(text, max_tokens, count_tokens)
+    elif strategy == "window":
+        spans = _window_chunks(text, max_length, overlap)
+    else:
+        raise ValueError(f"Unknown chunking strategy {strategy!r}")
+
+    chunks = []
+    for start, end in spans:
+        if start >= end and strategy != "sentence":
+            continue
+        chunk = Chunk(text[start:end], start, end)
+        if page_starts:
+            chunk.page_start = bisect_right(page_starts, start)
+            chunk.page_end = bisect_right(page_starts, max(start, end - 1))
+        chunks.append(chunk)
+    return chunks
+
+
+def chunk_text(text: str, max_length: int = 1000) -> List[str]:
+    """Sentence chunks as plain strings (drop-in for the old ``chunk_text``)."""
+    return [chunk.text for chunk in chunk_spans(text, "sentence", max_length)]
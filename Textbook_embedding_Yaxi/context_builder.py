@@ -0,0 +1,157 @@
+"""Token-budgeted RAG context from retrieved chunks.
+
+``build_context`` turns the top-k hits for a query into the context block
+pasted into the prompt:
+
+1. hits farther than ``max_distance`` are dropped (the nearest one is
+   always kept, so a question never goes without context)
+2. near-duplicate chunks (``dup_threshold`` of their word 5-grams already
+   seen in a nearer chunk) are dropped
+3. each remaining chunk is trimmed to the sentences sharing the most terms
+   with the query, at most ``chunk_tokens`` per chunk and ``token_budget``
+   overall; sentences already used by a nearer, overlapping chunk are
+   skipped. Kept sentences stay in their original order.
+
+``assemble_context`` applies the configured mode: ``RAG_CONTEXT=full`` (or
+a runner's ``--full-context``) passes the top-k chunks through unchanged
+for A/B comparison. Limits come from ``RAG_CONTEXT_TOKENS``,
+``RAG_CHUNK_TOKENS`` and ``RAG_MAX_DISTANCE`` or ``configure_context``.
+
+Tokens are estimated as characters / 4, which is close for English prose
+with both the Llama and GPT tokenizers and needs no tokenizer. The default
+distance cutoff is for the textbook index (normalised MiniLM embeddings,
+squared L2 = 2 - 2 * cosine).
+"""
+import math
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Set
+
+from chunking import SENTENCE_END
+
+CONTEXT_MODES = ("budgeted", "full")
+CONTEXT_MODE = os.environ.get("RAG_CONTEXT", "budgeted")  # "full" = top-k chunks unchanged
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("RAG_CONTEXT_TOKENS", "1000"))
+CHUNK_TOKENS = int(os.environ.get("RAG_CHUNK_TOKENS", "350"))
+MAX_DISTANCE = float(os.environ.get("RAG_MAX_DISTANCE", "1.3"))  # cosine >= 0.35
+DUP_THRESHOLD = 0.8
+SHINGLE = 5
+
+# Process-wide settings; runners map their --full-context / --context-tokens /
+# --chunk-tokens flags here with configure_context (defaults from the env)
+_settings = {"mode": CONTEXT_MODE, "token_budget": CONTEXT_TOKEN_BUDGET,
+             "chunk_tokens": CHUNK_TOKENS, "max_distance": MAX_DISTANCE}
+
+WORD = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+STOPWORDS = frozenset("""
+a an and are as at be by can does for from has have how in is it its of on or
+that the their these this to was were what when where which while who why will
+with would not no than then there they into also such most more may other
+""".split())
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / 4)
+
+
+def terms(text: str) -> Set[str]:
+    return {w for w in WORD.findall(text.lower()) if len(w) > 2 and w not in STOPWORDS}
+
+
+def split_sentences(text: str) -> List[str]:
+    sentences, start = [], 0
+    for match in SENTENCE_END.finditer(text):
+        sentences.append(text[start:match.end()].strip())
+        start = match.end()
+    sentences.append(text[start:].strip())
+    return [s for s in sentences if s]
+
+
+def _shingles(text: str) -> Set[tuple]:
+    words = WORD.findall(text.lower())
+    if len(words) < SHINGLE:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + SHINGLE]) for i in range(len(words) - SHINGLE + 1)}
+
+
+def _sentence_key(sentence: str) -> str:
+    return " ".join(WORD.findall(sentence.lower()))
+
+
+def _trim(sentences: List[str], query_terms: Set[str], limit: int, used: Set[str]) -> List[str]:
+    """The most query-relevant ``sentences`` fitting ``limit`` tokens, in order."""
+    candidates = [(i, s) for i, s in enumerate(sentences) if _sentence_key(s) not in used]
+    # more shared query terms first, then earlier sentences
+    ranked = sorted(candidates, key=lambda c: (-len(terms(c[1]) & query_terms), c[0]))
+    chosen, spent = [], 0
+    for i, sentence in ranked:
+        cost = estimate_tokens(sentence) + 1
+        if spent + cost > limit:
+            continue
+        chosen.append(i)
+        spent += cost
+    if not chosen and candidates and limit > 0:
+        # one long sentence over the limit: keep its head rather than nothing
+        chosen_text = candidates[0][1][:limit * 4].rsplit(" ", 1)[0]
+        return [chosen_text + " ..."] if chosen_text else []
+    return [sentences[i] for i in sorted(chosen)]
+
+
+def configure_context(mode: Optional[str] = None, token_budget: Optional[int] = None,
+                      chunk_tokens: Optional[int] = None,
+                      max_distance: Optional[float] = None):
+    """Override the defaults used by ``assemble_context``; ``None`` keeps a setting."""
+    if mode is not None and mode not in CONTEXT_MODES:
+        raise ValueError(f"Unknown context mode {mode!r}; expected one of {CONTEXT_MODES}")
+    updates = {"mode": mode, "token_budget": token_budget,
+               "chunk_tokens": chunk_tokens, "max_distance": max_distance}
+    _settings.update({k: v for k, v in updates.items() if v is not None})
+
+
+def context_settings() -> Dict:
+    return dict(_settings)
+
+
+def full_context(hits: Sequence[Dict]) -> str:
+    """Every hit, unchanged (the behaviour before the budgeted builder)."""
+    return "\n\n".join(hit["text"].replace("\n", " ") for hit in hits)
+
+
+def assemble_context(query: str, hits: Sequence[Dict]) -> str:
+    """Context for ``query`` under the configured mode and limits."""
+    if _settings["mode"] == "full":
+        return full_context(hits)
+    return build_context(query, hits, token_budget=_settings["token_budget"],
+                         chunk_tokens=_settings["chunk_tokens"],
+                         max_distance=_settings["max_distance"])
+
+
+def build_context(query: str, hits: Sequence[Dict],
+                  token_budget: int = CONTEXT_TOKEN_BUDGET,
+                  chunk_tokens: int = CHUNK_TOKENS,
+                  max_distance: float = MAX_DISTANCE,
+                  dup_threshold: float = DUP_THRESHOLD) -> str:
+    """Budgeted context block for ``query`` from its search ``hits``."""
+    hits = sorted(hits, key=lambda h: h.get("distance", 0.0))
+    hits = [h for i, h in enumerate(hits) if i == 0 or h.get("distance", 0.0) <= max_distance]
+
+    query_terms = terms(query)
+    seen_shingles: Set[tuple] = set()
+    used_sentences: Set[str] = set()
+    blocks, remaining = [], token_budget
+    for hit in hits:
+        text = hit["text"].replace("\n", " ")
+        shingles = _shingles(text)
+        if shingles and len(shingles & seen_shingles) >= dup_threshold * len(shingles):
+            continue
+        seen_shingles |= shingles
+        if remaining <= 0:
+            break
+        kept = _trim(split_sentences(text), query_terms, min(chunk_tokens, remaining), used_sentences)
+        if not kept:
+            continue
+        used_sentences.update(_sentence_key(s) for s in kept)
+        block = " ".join(kept)
+        blocks.append(block)
+        remaining -= estimate_tokens(block) + 1
+    return "\n\n".join(blocks)
@@ -0,0 +1,88 @@
+"""Batched corpus embedding straight into a float32 array or memmap.
+
+Texts are encoded longest-first in length-sorted batches, so each batch pads
+to similar lengths, and each batch is written into its rows of a
+preallocated output instead of going through Python lists.
+"""
+import os
+import time
+from typing import Optional, Sequence
+
+MIN_BATCH_SIZE = 8
+MAX_BATCH_SIZE = 512
+MEMORY_FRACTION = 0.25  # share of available RAM one batch may use
+
+
+def available_memory() -> Optional[int]:
+    """Available physical memory in bytes, or ``None`` if it cannot be read."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def auto_batch_size(dim: int, max_seq_length: int = 512, n_layers: int = 12) -> int:
+    """Largest power-of-two batch whose activations fit the memory budget.
+
+    Per text we budget ``max_seq_length * dim`` float32 activations for each
+    layer, times 4 for attention/FFN intermediates; crude, but it scales the
+    right way with model width and sequence length.
+    """
+    memory = available_memory()
+    if memory is None:
+        return 32
+    per_text = max_seq_length * dim * 4 * n_layers * 4
+    batch = MIN_BATCH_SIZE
+    while batch * 2 <= MAX_BATCH_SIZE and batch * 2 * per_text <= memory * MEMORY_FRACTION:
+        batch *= 2
+    return batch
+
+
+def encode_to_array(model, texts: Sequence[str], batch_size: Optional[int] = None,
+                    out=None, memmap_path=None, log_every: float = 10.0):
+    """Encode ``texts`` with a SentenceTransformer into an ``(n, dim)`` float32 array.
+
+    Rows are written into ``out`` if given, else into a new ``.npy`` memmap at
+    ``memmap_path``, else into a new in-memory array. Row ``i`` always holds
+    the embedding of ``texts[i]``, whatever order the batches ran in.
+    """
+    import numpy as np
+
+    n = len(texts)
+    dim = model.get_sentence_embedding_dimension()
+    if out is None:
+        if memmap_path is not None:
+            out = np.lib.format.open_memmap(memmap_path, mode="w+", dtype="float32", shape=(n, dim))
+        else:
+            out = np.empty((n, dim), dtype="float32")
+    if n == 0:
+        return out
+    if batch_size is None:
+        batch_size = auto_batch_size(dim, getattr(model, "max_seq_length", None) or 512)
+
+    # Longest first: similar lengths share a batch, and the biggest batch
+    # (the one most likely to run out of memory) runs before any work is done.
+    order = np.argsort([-len(t) for t in texts], kind="stable")
+    start_time = last_log = time.perf_counter()
+    for start in range(0, n, batch_size):
+        idx = order[start:start + batch_size]
+        out[idx] = model.encode(
+            [texts[i] for i in idx], batch_size=len(idx),
+            convert_to_numpy=True, show_progress_bar=False,
+        )
+        now = time.perf_counter()
+        if now - last_log >= log_every:
+            done = min(start + batch_size, n)
+            print(f"📦 {done}/{n} chunks, {done / (now - start_time):.1f} chunks/sec")
+            last_log = now
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    print(f"⚡ Embedded {n} chunks in {elapsed:.1f}s "
+          f"({n / elapsed:.1f} chunks/sec, batch size {batch_size})")
+    return out
@@ -0,0 +1,273 @@
+"""Pluggable sentence encoders: PyTorch SentenceTransformer or ONNX Runtime.
+
+Backends (pick with ``ENCODER_BACKEND`` or ``load_encoder(..., backend=)``):
+
+* ``torch`` -- the SentenceTransformer model as before (the default)
+* ``onnx`` -- the same transformer exported to ONNX, run by ONNX Runtime
+* ``onnx-int8`` -- the ONNX export with int8 dynamic quantisation
+
+The ONNX encoders import only ``onnxruntime``, ``tokenizers`` and numpy, so
+loading them never imports torch. Every backend exposes the part of the
+SentenceTransformer API the rest of the repo uses (``encode``,
+``get_sentence_embedding_dimension``, ``max_seq_length``).
+
+Export once (this step needs torch), then check agreement with PyTorch:
+
+    python Textbook_embedding_Yaxi/encoders.py export --model all-MiniLM-L6-v2
+    python Textbook_embedding_Yaxi/encoders.py parity --model all-MiniLM-L6-v2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from paths import CACHE_DIR, OPEN_ENDED_BANK_JSON, SCQ_BANK_JSON
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "torch")
+ONNX_DIR = CACHE_DIR / "onnx"
+ONNX_OPSET = 14
+CONFIG_FILE = "encoder_config.json"
+
+
+def onnx_model_dir(model_name: str) -> Path:
+    return ONNX_DIR / model_name.rstrip("/").split("/")[-1]
+
+
+class SentenceTransformerEncoder:
+    """The PyTorch SentenceTransformer, unchanged."""
+
+    backend = "torch"
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.max_seq_length = self.model.max_seq_length
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size: int = 32, **kwargs):
+        return self.model.encode(texts, batch_size=batch_size, **kwargs)
+
+
+class OnnxEncoder:
+    """ONNX Runtime encoder over a directory written by :func:`export_onnx`."""
+
+    def __init__(self, model_name: str, quantized: bool = False, model_dir=None,
+                 threads: Optional[int] = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.backend = "onnx-int8" if quantized else "onnx"
+        model_dir = Path(model_dir or onnx_model_dir(model_name))
+        model_file = model_dir / ("model_int8.onnx" if quantized else "model.onnx")
+        if not model_file.exists():
+            raise FileNotFoundError(
+                f"{model_file} not found; run `python encoders.py export --model {model_name}` first")
+        with open(model_dir / CONFIG_FILE, encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.max_seq_length = self.config["max_seq_length"]
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"],
+                                      pad_token=self.config["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(model_file), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def encode(self, texts, batch_size: int = 32, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False, normalize_embeddings: bool = False, **kwargs):
+        import numpy as np
+
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        out = np.empty((len(texts), self.config["dim"]), dtype="float32")
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            mask = np.asarray([e.attention_mask for e in encodings], dtype="int64")
+            feeds = {"input_ids": np.asarray([e.ids for e in encodings], dtype="int64"),
+                     "attention_mask": mask,
+                     "token_type_ids": np.asarray([e.type_ids for e in encodings], dtype="int64")}
+            hidden = self.session.run(None, {name: feeds[name] for name in self.input_names})[0]
+            out[start:start + len(encodings)] = self._pool(hidden, mask)
+        if self.config["normalize"] or normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out[0] if single else out
+
+    def _pool(self, hidden, mask):
+        import numpy as np
+
+        if self.config["pooling"] == "cls":
+            return hidden[:, 0]
+        weights = mask[..., None].astype("float32")
+        return (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+
+
+def load_encoder(model_name: str, backend: Optional[str] = None):
+    """Encoder for ``model_name`` on ``backend`` (default ``ENCODER_BACKEND``)."""
+    backend = backend or ENCODER_BACKEND
+    if backend == "torch":
+        return SentenceTransformerEncoder(model_name)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEncoder(model_name, quantized=backend == "onnx-int8")
+    raise ValueError(f"Unknown encoder backend {backend!r}; expected one of {BACKENDS}")
+
+
+def _pooling_config(st_model) -> Dict:
+    """Pooling mode and normalisation used by a SentenceTransformer pipeline."""
+    pooling, normalize = "mean", False
+    for module in st_model:
+        name = type(module).__name__
+        if name == "Pooling":
+            config = module.get_config_dict()
+            if config.get("pooling_mode_cls_token"):
+                pooling = "cls"
+            elif not config.get("pooling_mode_mean_tokens"):
+                raise ValueError(f"Unsupported pooling config {config}")
+        elif name == "Normalize":
+            normalize = True
+    return {"pooling": pooling, "normalize": normalize}
+
+
+def export_onnx(model_name: str, out_dir=None, quantize: bool = True) -> Path:
+    """Export ``model_name``'s transformer to ONNX (plus an int8 copy)."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out_dir = Path(out_dir or onnx_model_dir(model_name))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0]
+    features = st_model.tokenize(["An example sentence for tracing the export."])
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in features]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(names, inputs)))[0]
+
+    model_file = out_dir / "model.onnx"
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(transformer.auto_model.eval()),
+            tuple(features[n] for n in names), str(model_file),
+            input_names=names, output_names=["last_hidden_state"],
+            dynamic_axes={**{n: {0: "batch", 1: "seq"} for n in names},
+                          "last_hidden_state": {0: "batch", 1: "seq"}},
+            opset_version=ONNX_OPSET,
+        )
+    transformer.tokenizer.save_pretrained(str(out_dir))  # writes tokenizer.json
+    config = {
+        "model_name": model_name,
+        "dim": st_model.get_sentence_embedding_dimension(),
+        "max_seq_length": st_model.max_seq_length,
+        "pad_token": transformer.tokenizer.pad_token,
+        "pad_token_id": transformer.tokenizer.pad_token_id,
+        **_pooling_config(st_model),
+    }
+    with open(out_dir / CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    print(f"✅ Exported {model_name} to {model_file}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(str(model_file), str(out_dir / "model_int8.onnx"),
+                         weight_type=QuantType.QInt8)
+        print(f"✅ Quantised (int8 dynamic) to {out_dir / 'model_int8.onnx'}")
+    return out_dir
+
+
+def parity_texts() -> List[str]:
+    texts = []
+    for path in (SCQ_BANK_JSON, OPEN_ENDED_BANK_JSON):
+        with open(path, encoding="utf-8") as f:
+            texts.extend(item["question"].strip() for item in json.load(f) if item.get("question"))
+    return texts
+
+
+def parity_report(model_name: str, texts: Sequence[str],
+                  backends: Sequence[str] = ("onnx", "onnx-int8")) -> Dict:
+    """Cosine agreement and speed of each backend against PyTorch.
+
+    The ONNX backends are loaded first, so ``torch_imported`` shows whether
+    loading and running them pulled in torch.
+    """
+    import numpy as np
+
+    def unit(x):
+        x = np.asarray(x, dtype="float32")
+        return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+    report, outputs = {"model": model_name, "n_texts": len(texts), "backends": {}}, {}
+    for backend in list(backends) + ["torch"]:
+        start = time.perf_counter()
+        encoder = load_encoder(model_name, backend)
+        load_s = time.perf_counter() - start
+        start = time.perf_counter()
+        outputs[backend] = unit(encoder.encode(list(texts), batch_size=32))
+        encode_s = time.perf_counter() - start
+        report["backends"][backend] = {
+            "load_s": load_s,
+            "encode_s": encode_s,
+            "texts_per_s": len(texts) / max(encode_s, 1e-9),
+            "torch_imported": "torch" in sys.modules,
+        }
+    for backend in backends:
+        cos = (outputs[backend] * outputs["torch"]).sum(axis=1)
+        report["backends"][backend].update({
+            "cosine_mean": float(cos.mean()),
+            "cosine_min": float(cos.min()),
+            "cosine_p1": float(np.percentile(cos, 1)),
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="export a SentenceTransformer to ONNX (+ int8)")
+    export.add_argument("--model", default="all-MiniLM-L6-v2")
+    export.add_argument("--no-quantize", action="store_true")
+    parity = sub.add_parser("parity", help="compare ONNX backends with PyTorch on the question banks")
+    parity.add_argument("--model", default="all-MiniLM-L6-v2")
+    parity.add_argument("--backends", default="onnx,onnx-int8")
+    parity.add_argument("--out", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model, quantize=not args.no_quantize)
+        return
+    report = parity_report(args.model, parity_texts(), args.backends.split(","))
+    for backend, stats in report["backends"].items():
+        line = (f"{backend:>9}: load {stats['load_s']:.2f}s, {stats['texts_per_s']:.1f} texts/s, "
+                f"torch imported: {stats['torch_imported']}")
+        if "cosine_mean" in stats:
+            line += f", cosine mean {stats['cosine_mean']:.5f} min {stats['cosine_min']:.5f}"
+        print(line)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
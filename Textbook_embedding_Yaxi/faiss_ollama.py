@@ -1,11 +1,12 @@
-import ollama
-
+from llm_backends import get_backend
 from paths import fetch_rag_context
 
-query = input("❓ Your question: ")
-context = fetch_rag_context(query)
 
-prompt = f"""You are a biomaterials assistant.
+def main():
+    query = input("❓ Your question: ")
+    context = fetch_rag_context(query)
+
+    prompt = f"""You are a biomaterials assistant.
 
 CONTEXT:
 {context}
@@ -15,8 +16,11 @@ QUESTION:
 
 ANSWER:"""
 
-response = ollama.chat(model="llama3", messages=[
-    {"role": "user", "content": prompt}
-])
+    print("\n🧠 ", end="", flush=True)
+    for token in get_backend("ollama", "llama3").stream(prompt):
+        print(token, end="", flush=True)
+    print()
+
 
-print("\n🧠", response['message']['content'])
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""FAISS index factory shared by the textbook and abstract index builders.
+
+``build_index`` makes a flat (exact), HNSW, IVF-Flat or IVF-PQ index from a
+float32 matrix, training on a random sample where the index type needs it.
+``recall_at_k`` compares any of them against exact flat search so the
+speed/recall trade-off is known before an approximate index is used.
+"""
+import math
+import os
+from typing import Optional
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+TRAIN_SAMPLE = 100_000
+MIN_POINTS_PER_CENTROID = 39  # below this FAISS warns about k-means quality
+
+
+def default_nlist(n: int) -> int:
+    nlist = int(4 * math.sqrt(n))
+    return max(1, min(nlist, n // MIN_POINTS_PER_CENTROID))
+
+
+def _pq_params(dim: int, n: int):
+    m = next(m for m in (64, 48, 32, 24, 16, 8, 4, 2, 1) if dim % m == 0)
+    # 2**nbits centroids per sub-quantizer need enough training points
+    nbits = 8
+    while nbits > 4 and n < MIN_POINTS_PER_CENTROID * 2 ** nbits:
+        nbits -= 1
+    return m, nbits
+
+
+def make_index(kind: str, dim: int, n: int, nlist: Optional[int] = None):
+    """Create an empty index of type ``kind`` sized for about ``n`` vectors."""
+    import faiss
+
+    if kind == "flat":
+        return faiss.IndexFlatL2(dim)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+    nlist = nlist or default_nlist(n)
+    quantizer = faiss.IndexFlatL2(dim)
+    if kind == "ivf":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist)
+    if kind == "ivfpq":
+        m, nbits = _pq_params(dim, n)
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits)
+    raise ValueError(f"Unknown index type {kind!r}; expected one of {INDEX_TYPES}")
+
+
+def set_search_params(index, nprobe: int = DEFAULT_NPROBE,
+                      ef_search: int = DEFAULT_EF_SEARCH):
+    """Apply query-time knobs; a no-op for index types that do not have them."""
+    import faiss
+
+    base = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    if hasattr(base, "nprobe"):
+        base.nprobe = min(nprobe, base.nlist)
+    if hasattr(base, "hnsw"):
+        base.hnsw.efSearch = ef_search
+
+
+def build_index(kind: str, vectors, nlist: Optional[int] = None,
+                train_sample: int = TRAIN_SAMPLE, nprobe: int = DEFAULT_NPROBE,
+                ef_search: int = DEFAULT_EF_SEARCH, seed: int = 0, ids=None):
+    """Build, train (on up to ``train_sample`` rows) and fill an index.
+
+    With ``ids`` the index is wrapped in an ``IndexIDMap2`` so vectors keep
+    those ids and can later be removed with ``remove_ids``.
+    """
+    import faiss
+    import numpy as np
+
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, dim = vectors.shape
+    index = make_index(kind, dim, n, nlist)
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if n > train_sample:
+            sample = vectors[np.sort(rng.choice(n, train_sample, replace=False))]
+        print(f"🏋️ Training {kind} index on {len(sample)} vectors...")
+        index.train(sample)
+    if ids is not None:
+        index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    else:
+        index.add(vectors)
+    set_search_params(index, nprobe, ef_search)
+    return index
+
+
+def write_index(index, path):
+    """``faiss.write_index`` to a temp file, then swap it into place."""
+    import faiss
+
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, str(path))
+
+
+def recall_at_k(index, vectors, k: int = 10, n_queries: int = 1000,
+                queries=None, seed: int = 0, ids=None) -> float:
+    """Mean recall@k of ``index`` against exact flat search over ``vectors``.
+
+    ``queries`` defaults to a random sample of ``vectors`` themselves.
+    ``ids`` maps row positions to the ids the index was built with. The
+    ``-1`` padding FAISS returns when ``k`` exceeds the number of vectors
+    is ignored on both sides, so recall is over the true neighbours found.
+    """
+    import faiss
+    import numpy as np
+
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        n_queries = min(n_queries, len(vectors))
+        queries = vectors[rng.choice(len(vectors), n_queries, replace=False)]
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+    valid = truth >= 0  # FAISS pads with -1 when k exceeds the vectors
+    if ids is not None:
+        truth = np.where(valid, np.asarray(ids, dtype="int64")[np.maximum(truth, 0)], -1)
+    _, approx = index.search(queries, k)
+    hits = sum(len(set(t[t >= 0]) & set(a[a >= 0])) for t, a in zip(truth, approx))
+    return hits / max(1, int(valid.sum()))
@@ -0,0 +1,196 @@
+"""Per-stage timing for the question-bank runners.
+
+A runner calls ``start_trace`` once, wraps its per-question function with
+``traced`` and calls ``finish_trace`` at the end. Code anywhere below that
+(retrieval, prompt building, the LLM backends, parsing) marks its stages
+with ``span("name")`` and adds numbers with ``annotate(**metrics)``; both
+are no-ops while no trace is running, so library use stays free.
+
+Spans opened while a question is being answered land in that question's
+record; spans outside any question (the batched retrieval every runner does
+up front) land in the run record. Question records are appended to a JSONL
+trace as they finish, and ``finish_trace`` appends the run record and a
+p50/p95/p99 summary per stage and prints the summary.
+
+Stage names: ``retrieval.cache``, ``retrieval.remote`` (the daemon),
+``retrieval.load``, ``retrieval.encode``, ``retrieval.search`` and
+``retrieval.lookup`` (in-process), ``prompt``, ``llm``, ``parse`` and
+``total``. LLM metrics: ``llm.ttft_ms``, ``llm.tokens_per_s``,
+``llm.completion_tokens`` and, for Ollama, ``llm.queue_wait_ms`` (time the
+request spent waiting in the server before it was processed).
+
+Questions answered from the LLM response cache (``llm.cached``) are kept
+out of the generation-latency percentiles: their ``llm`` stage and
+``llm.*`` metrics are summarised separately under ``... (cached)``.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional, Sequence
+
+from paths import OUTPUTS_DIR
+
+TRACE_DIR = OUTPUTS_DIR / "traces"
+SUMMARY_PERCENTILES = (50, 95, 99)
+CACHED_SUFFIX = " (cached)"
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Linearly interpolated percentile (as ``numpy.percentile``)."""
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def _new_record(**fields) -> Dict:
+    return {**fields, "stages": {}, "metrics": {}}
+
+
+class Tracer:
+    """Collects stage timings for one run and appends them to ``path``."""
+
+    def __init__(self, path, **run_fields):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.run = _new_record(type="run", started=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                               **run_fields)
+        self.questions: List[Dict] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        self._start = time.perf_counter()
+
+    def current(self) -> Dict:
+        return getattr(self._local, "record", None) or self.run
+
+    @contextmanager
+    def span(self, name: str):
+        record = self.current()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            with self._lock:  # the run record is shared between threads
+                # repeated stages (retries, several searches) add up
+                record["stages"][name] = record["stages"].get(name, 0.0) + elapsed_ms
+
+    def annotate(self, **metrics):
+        record = self.current()
+        with self._lock:
+            record["metrics"].update(metrics)
+
+    @contextmanager
+    def question(self, qid):
+        record = _new_record(type="question", id=qid)
+        self._local.record = record
+        try:
+            with self.span("total"):
+                yield record
+        finally:
+            self._local.record = None
+            self._write(record)
+            with self._lock:
+                self.questions.append(record)
+
+    def _write(self, record: Dict):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def summary(self) -> Dict:
+        """Percentiles per question stage and metric, plus the run-level stages."""
+        samples: Dict[str, List[float]] = {}
+        counts: Dict[str, int] = {}
+        for record in self.questions:
+            # a cache hit is not a generation: summarise its LLM numbers apart
+            suffix = CACHED_SUFFIX if record["metrics"].get("llm.cached") is True else ""
+            for name, value in record["stages"].items():
+                key = f"{name}_ms" + (suffix if name == "llm" else "")
+                samples.setdefault(key, []).append(value)
+            for name, value in record["metrics"].items():
+                if isinstance(value, bool):
+                    counts[name] = counts.get(name, 0) + value
+                elif isinstance(value, (int, float)):
+                    key = name + (suffix if name.startswith("llm.") else "")
+                    samples.setdefault(key, []).append(value)
+        stats = {}
+        for name, values in sorted(samples.items()):
+            stats[name] = {f"p{q}": percentile(values, q) for q in SUMMARY_PERCENTILES}
+            stats[name].update(mean=sum(values) / len(values), n=len(values))
+        wall_s = time.perf_counter() - self._start
+        return {
+            "type": "summary",
+            "questions": len(self.questions),
+            "wall_s": wall_s,
+            "questions_per_s": len(self.questions) / wall_s if wall_s else 0.0,
+            "run_stages_ms": dict(self.run["stages"]),
+            "stages": stats,
+            "counts": counts,
+        }
+
+    def close(self) -> Dict:
+        summary = self.summary()
+        self.run["metrics"]["wall_s"] = summary["wall_s"]
+        self._write(self.run)
+        self._write(summary)
+        self._file.close()
+        return summary
+
+
+_tracer: Optional[Tracer] = None
+
+
+def start_trace(name: str, **run_fields) -> Tracer:
+    """Start tracing this process to ``outputs/traces/<name>_<timestamp>.jsonl``."""
+    global _tracer
+    path = TRACE_DIR / f"{name}_{time.strftime('%Y%m%d-%H%M%S')}.jsonl"
+    _tracer = Tracer(path, name=name, **run_fields)
+    return _tracer
+
+
+def finish_trace() -> Optional[Dict]:
+    """Write the run record and summary, print the summary and stop tracing."""
+    global _tracer
+    if _tracer is None:
+        return None
+    tracer, _tracer = _tracer, None
+    summary = tracer.close()
+    print_summary(summary)
+    print(f"🧭 Trace written to {tracer.path}")
+    return summary
+
+
+def span(name: str):
+    """Time a stage of the current question (or of the run, outside one)."""
+    return _tracer.span(name) if _tracer is not None else nullcontext()
+
+
+def annotate(**metrics):
+    if _tracer is not None:
+        _tracer.annotate(**metrics)
+
+
+def traced(fn: Callable, key: str = "id") -> Callable:
+    """Wrap a runner's ``fn(item)`` so each call becomes one question record."""
+    def wrapper(item):
+        if _tracer is None:
+            return fn(item)
+        with _tracer.question(item[key]):
+            return fn(item)
+    return wrapper
+
+
+def print_summary(summary: Dict):
+    print(f"\n⏱️  {summary['questions']} questions in {summary['wall_s']:.1f}s "
+          f"({summary['questions_per_s']:.2f}/s)")
+    for name, ms in summary["run_stages_ms"].items():
+        print(f"   {name:<24} {ms:10.1f} ms (whole run)")
+    for name, stats in summary["stages"].items():
+        print(f"   {name:<24} p50 {stats['p50']:9.1f}  p95 {stats['p95']:9.1f}  "
+              f"p99 {stats['p99']:9.1f}  (n={stats['n']})")
+    for name, count in summary["counts"].items():
+        print(f"   {name:<24} {count} of {summary['questions']}")
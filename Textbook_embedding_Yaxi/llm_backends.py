@@ -0,0 +1,340 @@
+"""Shared LLM backends for the question-bank runners.
+
+Each backend owns one long-lived client (one HTTP connection pool) and is
+safe to call from several runner threads at once.
+"""
+import json
+import math
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+from instrumentation import annotate, span
+from llm_cache import cache_key, get_llm_cache
+
+OLLAMA_KEEP_ALIVE = "30m"
+TOP_LOGPROBS = 20
+
+# The runners' --constrained single-choice mode: prompt tail, option letters
+# and the result they record when the call fails
+CONSTRAINED_FORMAT = """Answer with the letter of the best option only: a, b, c, or d.
+"""
+OPTION_LETTERS = ("a", "b", "c", "d")
+NO_CHOICE = {"choice": "", "probs": None, "raw": ""}
+
+
+def _field(obj, name):
+    """``obj[name]`` for dict responses, ``obj.name`` for typed client objects."""
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def _as_choice(token: str) -> str:
+    return (token or "").strip().strip("\"'().:*").lower()
+
+
+def option_distribution(top_logprobs: Iterable, choices: Sequence[str]) -> Optional[Dict[str, float]]:
+    """Probabilities of ``choices`` from one position's ``(token, logprob)`` list.
+
+    Spellings of the same option (``"b"``, ``" B"``, ``"b)"``) are summed and
+    the result is renormalised over ``choices``; ``None`` when none appear.
+    """
+    mass = {choice: 0.0 for choice in choices}
+    for token, logprob in top_logprobs:
+        choice = _as_choice(token)
+        if choice in mass:
+            mass[choice] += math.exp(logprob)
+    total = sum(mass.values())
+    if total <= 0:
+        return None
+    return {choice: p / total for choice, p in mass.items()}
+
+
+def _choice_result(text: str, choices: Sequence[str], probs: Optional[Dict[str, float]]) -> Dict:
+    choice = _as_choice(text)
+    if probs:
+        choice = max(probs, key=probs.get)
+    return {"choice": choice if choice in choices else "", "probs": probs, "raw": text}
+
+
+def format_confidence(probs: Optional[Dict[str, float]]) -> str:
+    """``{"a": 0.91, ...}`` as JSON for the CSV; empty without logprobs."""
+    return json.dumps({k: round(v, 4) for k, v in probs.items()}) if probs else ""
+
+
+class LLMBackend:
+    name = "base"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def generate(self, prompt: str, system: Optional[str] = None, **options) -> str:
+        return "".join(self.stream(prompt, system, **options))
+
+    def stream(self, prompt: str, system: Optional[str] = None, **options) -> Iterator[str]:
+        raise NotImplementedError
+
+    def choose(self, prompt: str, choices: Sequence[str], system: Optional[str] = None,
+               **options) -> Dict:
+        """Answer with exactly one of ``choices`` in a single constrained step.
+
+        Returns ``{"choice", "probs", "raw"}``: ``probs`` is the distribution
+        over ``choices`` from the answer token's logprobs (``None`` when the
+        backend does not expose them) and ``choice`` its argmax, or the
+        generated option when there is no distribution; ``""`` if the model
+        produced none of ``choices``.
+        """
+        raise NotImplementedError
+
+    def traced_choose(self, prompt: str, choices: Sequence[str], system: Optional[str] = None,
+                      **options) -> Dict:
+        with span("llm"):
+            return self.choose(prompt, choices, system, **options)
+
+    def traced_generate(self, prompt: str, system: Optional[str] = None, **options) -> str:
+        """``generate`` through ``stream``, recording time to first token and tokens/sec.
+
+        Both servers stream about one token per part, so the rate counts
+        parts; backends add the server's own token counts where it sends them.
+        """
+        parts = []
+        first = None
+        with span("llm"):
+            start = time.perf_counter()
+            for part in self.stream(prompt, system, **options):
+                if first is None and part:
+                    first = time.perf_counter()
+                parts.append(part)
+            end = time.perf_counter()
+        if first is not None:
+            tokens = sum(1 for part in parts if part)
+            annotate(**{"llm.ttft_ms": (first - start) * 1000.0,
+                        "llm.stream_parts": tokens})
+            if tokens > 1 and end > first:  # a cached answer arrives as one part
+                annotate(**{"llm.tokens_per_s": (tokens - 1) / (end - first)})
+        return "".join(parts)
+
+    @staticmethod
+    def _messages(prompt, system):
+        messages = [{"role": "user", "content": prompt}]
+        if system is not None:
+            messages.insert(0, {"role": "system", "content": system})
+        return messages
+
+
+class OllamaBackend(LLMBackend):
+    """Talks to the Ollama server through one ``ollama.Client``.
+
+    ``keep_alive`` keeps the model loaded between questions, so only the first
+    request of a run pays the model load. ``options`` are passed through as
+    Ollama model options (``temperature``, ``num_predict``, ...).
+    """
+    name = "ollama"
+
+    def __init__(self, model: str = "llama3", host: Optional[str] = None,
+                 keep_alive: str = OLLAMA_KEEP_ALIVE):
+        import ollama
+
+        super().__init__(model)
+        self.client = ollama.Client(host=host)
+        self.keep_alive = keep_alive
+        self._logprobs_supported = True
+
+    def generate(self, prompt: str, system: Optional[str] = None, **options) -> str:
+        response = self.client.chat(
+            model=self.model,
+            messages=self._messages(prompt, system),
+            options=options or None,
+            keep_alive=self.keep_alive,
+        )
+        return response["message"]["content"]
+
+    def stream(self, prompt: str, system: Optional[str] = None, **options) -> Iterator[str]:
+        start = time.perf_counter()
+        for part in self.client.chat(
+            model=self.model,
+            messages=self._messages(prompt, system),
+            options=options or None,
+            keep_alive=self.keep_alive,
+            stream=True,
+        ):
+            if part.get("done"):
+                self._annotate_usage(part, time.perf_counter() - start)
+            yield part["message"]["content"]
+
+    def choose(self, prompt: str, choices: Sequence[str], system: Optional[str] = None,
+               **options) -> Dict:
+        """The answer is grammar-constrained to a JSON string from ``choices``
+        (``"b"``, about three tokens) via Ollama structured outputs, so it
+        always parses. Logprobs are requested from servers that support them.
+        """
+        kwargs = dict(
+            model=self.model,
+            messages=self._messages(prompt, system),
+            format={"type": "string", "enum": list(choices)},
+            options={"num_predict": 4, **options},
+            keep_alive=self.keep_alive,
+        )
+        start = time.perf_counter()
+        if self._logprobs_supported:
+            try:
+                response = self.client.chat(**kwargs, logprobs=True, top_logprobs=TOP_LOGPROBS)
+            except TypeError:  # ollama-python before 0.6.1 has no logprobs
+                self._logprobs_supported = False
+        if not self._logprobs_supported:
+            response = self.client.chat(**kwargs)
+        self._annotate_usage(response, time.perf_counter() - start)
+
+        probs = None
+        for entry in _field(response, "logprobs") or []:
+            if _as_choice(_field(entry, "token")) in choices:  # skip the JSON quotes
+                probs = option_distribution(
+                    ((_field(t, "token"), _field(t, "logprob"))
+                     for t in _field(entry, "top_logprobs") or []), choices)
+                break
+        return _choice_result(_field(response, "message")["content"], choices, probs)
+
+    @staticmethod
+    def _annotate_usage(final, wall_s):
+        """Server-side counts from the last streamed part (durations are in ns)."""
+        eval_count = final.get("eval_count") or 0
+        eval_s = (final.get("eval_duration") or 0) / 1e9
+        metrics = {"llm.completion_tokens": eval_count,
+                   "llm.prompt_tokens": final.get("prompt_eval_count") or 0}
+        if eval_s:
+            metrics["llm.server_tokens_per_s"] = eval_count / eval_s
+        if final.get("total_duration"):
+            # whatever the server did not spend on this request was queueing
+            metrics["llm.queue_wait_ms"] = max(0.0, wall_s - final["total_duration"] / 1e9) * 1000.0
+        annotate(**metrics)
+
+
+class OpenAIBackend(LLMBackend):
+    """Chat Completions backend; the API key comes from ``OPENAI_API_KEY``."""
+    name = "openai"
+
+    def __init__(self, model: str = "gpt-4o"):
+        from openai import OpenAI
+
+        super().__init__(model)
+        self.client = OpenAI()
+
+    def generate(self, prompt: str, system: Optional[str] = None, **options) -> str:
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(prompt, system),
+            **options,
+        )
+        return response.choices[0].message.content
+
+    def choose(self, prompt: str, choices: Sequence[str], system: Optional[str] = None,
+               **options) -> Dict:
+        """One completion token with the top-20 alternatives' logprobs."""
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(prompt, system),
+            max_tokens=1,
+            logprobs=True,
+            top_logprobs=TOP_LOGPROBS,
+            **options,
+        )
+        choice = response.choices[0]
+        if response.usage:
+            annotate(**{"llm.completion_tokens": response.usage.completion_tokens,
+                        "llm.prompt_tokens": response.usage.prompt_tokens})
+        probs = None
+        if choice.logprobs and choice.logprobs.content:
+            probs = option_distribution(((t.token, t.logprob)
+                                         for t in choice.logprobs.content[0].top_logprobs), choices)
+        return _choice_result(choice.message.content or "", choices, probs)
+
+    def stream(self, prompt: str, system: Optional[str] = None, **options) -> Iterator[str]:
+        for chunk in self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(prompt, system),
+            stream=True,
+            stream_options={"include_usage": True},
+            **options,
+        ):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            elif getattr(chunk, "usage", None):  # last chunk, no choices
+                annotate(**{"llm.completion_tokens": chunk.usage.completion_tokens,
+                            "llm.prompt_tokens": chunk.usage.prompt_tokens})
+
+
+class CachedBackend(LLMBackend):
+    """Wraps a backend with the on-disk response cache in ``llm_cache``."""
+
+    def __init__(self, backend: LLMBackend, cache):
+        super().__init__(backend.model)
+        self.name = backend.name
+        self.backend = backend
+        self.cache = cache
+
+    def generate(self, prompt: str, system: Optional[str] = None, **options) -> str:
+        key = cache_key(self.name, self.model, prompt, system, **options)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        response = self.backend.generate(prompt, system, **options)
+        if response:  # never cache failed/empty answers
+            self.cache.put(key, response)
+        return response
+
+    def choose(self, prompt: str, choices: Sequence[str], system: Optional[str] = None,
+               **options) -> Dict:
+        key = cache_key(self.name, self.model, prompt, system,
+                        choose=list(choices), **options)
+        cached = self.cache.get(key)
+        if cached is not None:
+            annotate(**{"llm.cached": True})
+            return json.loads(cached)
+        result = self.backend.choose(prompt, choices, system, **options)
+        if result["choice"]:  # never cache failed answers
+            self.cache.put(key, json.dumps(result))
+        return result
+
+    def stream(self, prompt: str, system: Optional[str] = None, **options) -> Iterator[str]:
+        key = cache_key(self.name, self.model, prompt, system, **options)
+        cached = self.cache.get(key)
+        if cached is not None:
+            annotate(**{"llm.cached": True})
+            yield cached
+            return
+        parts = []
+        for part in self.backend.stream(prompt, system, **options):
+            parts.append(part)
+            yield part
+        text = "".join(parts)
+        if text:  # never cache failed/empty answers, as in generate
+            self.cache.put(key, text)
+
+
+_BACKENDS = {"ollama": OllamaBackend, "openai": OpenAIBackend}
+_instances: Dict[Tuple[str, str, bool], LLMBackend] = {}
+_instances_lock = threading.Lock()
+_cache_enabled = True
+
+
+def set_cache_enabled(enabled: bool):
+    """Default for ``get_backend(cache=None)``; runners map ``--no-cache`` here."""
+    global _cache_enabled
+    _cache_enabled = enabled
+
+
+def get_backend(name: str, model: str, cache: Optional[bool] = None) -> LLMBackend:
+    """Return the process-wide backend for ``(name, model)``, creating it once.
+
+    With caching on (the default) responses are served from and stored in
+    the on-disk LLM cache (see ``llm_cache.py``).
+    """
+    if cache is None:
+        cache = _cache_enabled
+    key = (name, model, cache)
+    with _instances_lock:
+        if key not in _instances:
+            backend = _BACKENDS[name](model)
+            if cache:
+                backend = CachedBackend(backend, get_llm_cache())
+            _instances[key] = backend
+        return _instances[key]
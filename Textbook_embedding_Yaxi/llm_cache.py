@@ -0,0 +1,138 @@
+"""Content-addressed on-disk cache for LLM responses (SQLite).
+
+Entries are keyed by a hash of (backend, model, system, prompt, options),
+so re-running an experiment with unchanged prompts makes no model calls.
+Old entries are evicted by age and, past ``max_bytes``, least recently used
+first.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from paths import CACHE_DIR
+
+LLM_CACHE_DB = CACHE_DIR / "llm_cache.sqlite"
+MAX_BYTES = 512 * 1024 * 1024
+MAX_AGE_DAYS = 90
+
+
+def cache_key(backend: str, model: str, prompt: str, system: Optional[str] = None,
+              **options) -> str:
+    payload = json.dumps(
+        {"backend": backend, "model": model, "system": system,
+         "prompt": prompt, "options": options},
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path=LLM_CACHE_DB, max_bytes: Optional[int] = MAX_BYTES,
+                 max_age_days: Optional[float] = MAX_AGE_DAYS):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+            " size INTEGER NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            self._conn.commit()
+
+    def evict(self) -> int:
+        """Drop entries older than ``max_age_days``, then LRU down to ``max_bytes``."""
+        removed = 0
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute(
+                    "DELETE FROM responses WHERE last_used < ?", (cutoff,)
+                ).rowcount
+            if self.max_bytes is not None:
+                total = self._conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()[0]
+                if total > self.max_bytes:
+                    rows = self._conn.execute(
+                        "SELECT key, size FROM responses ORDER BY last_used"
+                    ).fetchall()
+                    stale = []
+                    for key, size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        stale.append((key,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                    removed += len(stale)
+            self._conn.commit()
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
+
+
+def print_cache_stats():
+    """Print hit/miss stats if this process used the LLM cache."""
+    if _cache is None:
+        return
+    s = _cache.stats()
+    print(f"💾 LLM cache: {s['hits']} hits, {s['misses']} misses "
+          f"({s['hit_rate']:.0%} hit rate), {s['entries']} entries, "
+          f"{s['bytes'] / 1e6:.1f} MB")
@@ -0,0 +1,194 @@
+"""Random-access chunk metadata store, one record per FAISS vector id.
+
+A store with prefix ``p`` is two or three files:
+
+* ``p.jsonl`` -- one JSON object per chunk (text, source, ...)
+* ``p.offsets.npy`` -- int64 byte offsets of each line, plus the end offset
+* ``p.ids.npy`` -- optional sorted int64 vector ids, one per line, for
+  indexes built with explicit ids (``IndexIDMap2``); without it the
+  vector id is the line number. After ``append_chunk_store`` it holds
+  ``(id, line)`` pairs sorted by id, since appended lines are not in id order
+
+Readers memory-map all of them, so opening a store costs nothing
+proportional to the corpus and a lookup decodes only the one record.
+"""
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+
+def store_files(prefix):
+    prefix = Path(prefix)
+    return (prefix.parent / f"{prefix.name}.jsonl",
+            prefix.parent / f"{prefix.name}.offsets.npy")
+
+
+def ids_file(prefix) -> Path:
+    prefix = Path(prefix)
+    return prefix.parent / f"{prefix.name}.ids.npy"
+
+
+def _save_npy(path: Path, array):
+    """``np.save`` to a temp file, then swap it into place."""
+    import numpy as np
+
+    tmp_path = path.parent / f"{path.name}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def write_chunk_store(prefix, records: Iterable[Dict], ids: Optional[Iterable[int]] = None) -> int:
+    """Write ``records`` and return how many were written.
+
+    Without ``ids`` records must be in vector-id order. With ``ids`` they may
+    come in any order; they are written sorted by id. Every file is written
+    to a temp path and swapped in, so a failure leaves the old store intact.
+    """
+    import numpy as np
+
+    blob_path, offsets_path = store_files(prefix)
+    if ids is not None:
+        ids = np.asarray(list(ids), dtype=np.int64)
+        records = list(records)
+        order = np.argsort(ids, kind="stable")
+        records = [records[i] for i in order]
+        ids = ids[order]
+    offsets = [0]
+    tmp_blob = blob_path.parent / f"{blob_path.name}.tmp"
+    with open(tmp_blob, "wb") as f:
+        for record in records:
+            line = json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    os.replace(tmp_blob, blob_path)
+    _save_npy(offsets_path, np.asarray(offsets, dtype=np.int64))
+    if ids is not None:
+        _save_npy(ids_file(prefix), ids)
+    elif ids_file(prefix).exists():
+        ids_file(prefix).unlink()
+    return len(offsets) - 1
+
+
+def append_chunk_store(prefix, records: Iterable[Dict], ids: Iterable[int]) -> int:
+    """Append ``records`` with ``ids`` to a store written with ``ids``.
+
+    Only the new lines are encoded and written; existing records are never
+    decoded. The ids file becomes ``(id, line)`` pairs sorted by id, so new
+    ids may fall anywhere in the id order. Offsets are swapped in before the
+    ids: until the ids are, readers see the old store (bytes and offsets past
+    the last id's line are never read and are dropped by the next append).
+    """
+    import numpy as np
+
+    blob_path, offsets_path = store_files(prefix)
+    if not ids_file(prefix).exists():
+        raise ValueError(f"{prefix} has no ids file; rebuild it with write_chunk_store(ids=...)")
+    old = np.load(ids_file(prefix))
+    if old.ndim == 1:  # as written by write_chunk_store: line == position
+        old = np.stack([old, np.arange(len(old), dtype=np.int64)], axis=1)
+    n = len(old)
+    old_offsets = np.load(offsets_path)[:n + 1]
+    ids = np.asarray(list(ids), dtype=np.int64)
+    records = list(records)
+    if np.intersect1d(ids, old[:, 0]).size or len(np.unique(ids)) != len(ids):
+        raise ValueError("appended ids must be unique and not already in the store")
+
+    offsets = [int(old_offsets[-1])]
+    with open(blob_path, "r+b") as f:
+        f.truncate(offsets[0])
+        f.seek(offsets[0])
+        for record in records:
+            line = json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+        f.flush()
+        os.fsync(f.fileno())
+    pairs = np.concatenate([old, np.stack([ids, np.arange(n, n + len(ids), dtype=np.int64)], axis=1)])
+    _save_npy(offsets_path, np.concatenate([old_offsets, np.asarray(offsets[1:], dtype=np.int64)]))
+    _save_npy(ids_file(prefix), pairs[np.argsort(pairs[:, 0], kind="stable")])
+    return len(records)
+
+
+def trim_chunk_store(prefix, keep_ids: Iterable[int]) -> int:
+    """Drop the store's trailing records whose ids are not in ``keep_ids``.
+
+    Repairs a store appended to by a run that died before its index was
+    saved. Only a tail of lines can be dropped, so the store stays
+    appendable; other missing ids raise ``ValueError``. Returns how many
+    records were dropped.
+    """
+    import numpy as np
+
+    blob_path, offsets_path = store_files(prefix)
+    pairs = np.load(ids_file(prefix))
+    if pairs.ndim == 1:
+        pairs = np.stack([pairs, np.arange(len(pairs), dtype=np.int64)], axis=1)
+    stale = ~np.isin(pairs[:, 0], np.asarray(list(keep_ids), dtype=np.int64))
+    if not stale.any():
+        return 0
+    n = int(pairs[stale, 1].min())
+    if int(stale.sum()) != len(pairs) - n:
+        raise ValueError(f"{prefix} is missing ids other than its last {len(pairs) - n} lines")
+    # ids first: readers and append_chunk_store only use offsets up to len(ids)
+    _save_npy(ids_file(prefix), pairs[~stale])
+    _save_npy(offsets_path, np.load(offsets_path)[:n + 1])
+    return len(pairs) - n
+
+
+def chunk_store_exists(prefix) -> bool:
+    return all(p.exists() for p in store_files(prefix))
+
+
+class ChunkStore:
+    def __init__(self, prefix):
+        import numpy as np
+
+        blob_path, offsets_path = store_files(prefix)
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self.ids = self._lines = None
+        if ids_file(prefix).exists():
+            ids = np.load(ids_file(prefix), mmap_mode="r")
+            if ids.ndim == 2:  # (id, line) pairs after append_chunk_store
+                ids, self._lines = ids[:, 0], ids[:, 1]
+            self.ids = ids
+        self._file = open(blob_path, "rb")
+        # mmap refuses zero-length files
+        self._blob = (mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                      if self.offsets[-1] > 0 else b"")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1 if self.ids is None else len(self.ids)
+
+    def __getitem__(self, i: int) -> Dict:
+        """Record at line ``i``."""
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return json.loads(self._blob[start:end])
+
+    def get(self, vector_id: int) -> Dict:
+        """Record for FAISS vector id ``vector_id``."""
+        if self.ids is None:
+            return self[vector_id]
+        import numpy as np
+
+        i = int(np.searchsorted(self.ids, vector_id))
+        if i >= len(self.ids) or self.ids[i] != vector_id:
+            raise KeyError(vector_id)
+        return self[self._line(i)]
+
+    def items(self) -> Iterator[Tuple[int, Dict]]:
+        """``(vector id, record)`` in id order."""
+        for i in range(len(self)):
+            yield (int(self.ids[i]) if self.ids is not None else i), self[self._line(i)]
+
+    def _line(self, i: int) -> int:
+        return int(self._lines[i]) if self._lines is not None else i
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
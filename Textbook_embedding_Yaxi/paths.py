@@ -1,28 +1,93 @@
 """Repository path helpers (portable across machines)."""
+import os
 from pathlib import Path
 
 REPO_ROOT = Path(__file__).resolve().parent.parent
 MODULE_DIR = Path(__file__).resolve().parent
 DATA_DIR = MODULE_DIR / "data"
 OUTPUTS_DIR = MODULE_DIR / "outputs"
+CACHE_DIR = MODULE_DIR / "cache"
 TEXTBOOK_DIR = REPO_ROOT / "textbook"
 
-SEARCH_FAISS_SCRIPT = MODULE_DIR / "search_faiss.py"
 FAISS_INDEX = TEXTBOOK_DIR / "biomaterials_index.faiss"
-METADATA_CSV = TEXTBOOK_DIR / "biomaterials_metadata.csv"
+METADATA_CSV = TEXTBOOK_DIR / "biomaterials_metadata.csv"  # legacy builds
+METADATA_STORE = TEXTBOOK_DIR / "biomaterials_metadata"  # see metadata_store.py
+INDEX_MANIFEST = TEXTBOOK_DIR / "biomaterials_manifest.json"
 EXPORT_TEXTBOOK_CSV = TEXTBOOK_DIR / "export_textbook.csv"
 
+# PubMed abstract index (Search_Paper_jiayu/embedding_abstracts.py)
+ABSTRACTS_DIR = Path(os.environ.get("ABSTRACTS_DIR", "/remote-home/jiayuguo/RAG-search"))
+ABSTRACTS_FAISS_INDEX = ABSTRACTS_DIR / "abstracts_index.faiss"
+ABSTRACTS_METADATA_STORE = ABSTRACTS_DIR / "abstracts_metadata"
+
 SCQ_BANK_JSON = DATA_DIR / "scq_bank.json"
 OPEN_ENDED_BANK_JSON = DATA_DIR / "question_bank_open_ended.json"
 
+# Local retrieval daemon (retrieval_server.py); used when it is running
+RETRIEVAL_SERVER_URL = os.environ.get("RAG_SERVER_URL", "http://127.0.0.1:8765")
+
+
+def format_context(hits) -> str:
+    from context_builder import full_context
+
+    return full_context(hits)
+
+
+def search_chunks(queries, k: int = 5, use_cache: bool = True):
+    """Top-``k`` hits per query.
+
+    Results come from the retrieval cache when possible; the rest are
+    searched on the retrieval daemon if it is up, else in-process.
+    """
+    from instrumentation import annotate, span
+    from retrieval_cache import get_retrieval_cache
+
+    queries = list(queries)
+    with span("retrieval.cache"):
+        cache = get_retrieval_cache() if use_cache else None
+        found = cache.get_many(queries, k) if cache is not None else {}
+    missing = [q for q in dict.fromkeys(queries) if q not in found]
+    annotate(**{"retrieval.queries": len(queries), "retrieval.cache_misses": len(missing)})
+    if missing:
+        fresh = dict(zip(missing, _search_uncached(missing, k)))
+        if cache is not None:
+            with span("retrieval.cache"):
+                cache.put_many(fresh, k)
+        found.update(fresh)
+    return [found[q] for q in queries]
+
+
+def _search_uncached(queries, k):
+    from instrumentation import span
+    from retrieval_server import remote_search_batch
+
+    with span("retrieval.remote"):  # stages run in the daemon are not split out
+        results = remote_search_batch(queries, k)
+    if results is None:
+        from retriever import get_retriever
+
+        with span("retrieval.load"):  # only the first in-process search loads
+            retriever = get_retriever()
+        results = retriever.search_batch(queries, k)
+    return results
+
+
+def fetch_rag_context(query: str, k: int = 5) -> str:
+    """Prompt context for ``query`` from its top-``k`` chunks: budgeted and
+    de-duplicated, or unchanged in full mode (see ``context_builder``)."""
+    return fetch_rag_contexts({None: query}, k)[None]
+
 
-def fetch_rag_context(query: str) -> str:
-    import subprocess
-    import sys
+def fetch_rag_contexts(queries: dict, k: int = 5) -> dict:
+    """Batched ``fetch_rag_context`` for ``{question_id: query}``."""
+    from context_builder import assemble_context, context_settings, estimate_tokens
+    from instrumentation import annotate, span
 
-    results = subprocess.check_output(
-        [sys.executable, str(SEARCH_FAISS_SCRIPT), query],
-        text=True,
-    )
-    chunks = [line for line in results.strip().split("\n") if line]
-    return "\n\n".join(chunks)
+    ids = list(queries)
+    results = search_chunks([queries[i] for i in ids], k)
+    with span("context"):
+        contexts = {qid: assemble_context(queries[qid], hits) for qid, hits in zip(ids, results)}
+    annotate(**{"context.mode": context_settings()["mode"],
+                "context.tokens": sum(estimate_tokens(c) for c in contexts.values()),
+                "context.raw_tokens": sum(estimate_tokens(format_context(hits)) for hits in results)})
+    return contexts
@@ -1,7 +1,6 @@
 import re
 import json
 import uuid
-from docx import Document
 
 def is_numbered_list(paragraph):
     """
@@ -12,6 +11,8 @@ def is_numbered_list(paragraph):
     return pPr is not None and getattr(pPr, 'numPr', None) is not None
 
 def parse_docx_to_question_bank(docx_path):
+    from docx import Document
+
     doc = Document(docx_path)
     questions = []
     current_unit = None
@@ -1,9 +1,10 @@
 import re
 import json
 import uuid
-from docx import Document
 
 def parse_docx_to_mcq(docx_path):
+    from docx import Document
+
     doc = Document(docx_path)
     mcqs = []
     current_section = None
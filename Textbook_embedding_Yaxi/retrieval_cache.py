@@ -0,0 +1,119 @@
+"""Persistent cache of retrieval results (SQLite).
+
+Keyed by (normalised query, embedding model, search parameters, index
+fingerprint, k). The fingerprint is derived from the size and mtime of the
+FAISS index and its metadata and is re-checked on every batch lookup, so
+rebuilding the index with ``textbook_embedding.py`` invalidates every cached
+result automatically, even in a process that was already running.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+from metadata_store import store_files
+from paths import CACHE_DIR, FAISS_INDEX, METADATA_CSV, METADATA_STORE
+
+RETRIEVAL_CACHE_DB = CACHE_DIR / "retrieval_cache.sqlite"
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", query)).strip()
+
+
+def index_fingerprint(*paths) -> str:
+    h = hashlib.sha256()
+    for path in paths:
+        st = path.stat()
+        h.update(f"{path.name}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()[:16]
+
+
+class RetrievalCache:
+    def __init__(self, fingerprint: str, model_name: str, search_params: Optional[Dict] = None,
+                 path=RETRIEVAL_CACHE_DB):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.fingerprint = fingerprint
+        self.model_name = model_name
+        self.search_params = dict(search_params or {})
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, hits TEXT NOT NULL)"
+        )
+        self._drop_stale()
+
+    def _drop_stale(self):
+        # Results computed against any earlier build of the index are stale
+        self._conn.execute("DELETE FROM results WHERE fingerprint != ?", (self.fingerprint,))
+        self._conn.commit()
+
+    def refresh(self, fingerprint: str):
+        """Switch to ``fingerprint`` (the index was rebuilt) and drop old results."""
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                self._drop_stale()
+
+    def _key(self, query: str, k: int) -> str:
+        payload = json.dumps([normalize_query(query), self.model_name,
+                              sorted(self.search_params.items()), self.fingerprint, k])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_many(self, queries: Sequence[str], k: int) -> Dict[str, List[Dict]]:
+        found = {}
+        with self._lock:
+            for query in queries:
+                row = self._conn.execute(
+                    "SELECT hits FROM results WHERE key = ?", (self._key(query, k),)
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    found[query] = json.loads(row[0])
+        return found
+
+    def put_many(self, results: Dict[str, List[Dict]], k: int):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                [(self._key(q, k), self.fingerprint, json.dumps(hits))
+                 for q, hits in results.items()],
+            )
+            self._conn.commit()
+
+
+_cache: Optional[RetrievalCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache() -> Optional[RetrievalCache]:
+    """Process-wide cache for the textbook index, or ``None`` if it is not built.
+
+    Call it once per batch: it re-stats the index files each time and drops
+    cached results when they have changed.
+    """
+    global _cache
+    from encoders import ENCODER_BACKEND
+    from retriever import MODEL_NAME, SEARCH_PARAMS
+
+    try:
+        metadata = [p for p in (*store_files(METADATA_STORE), METADATA_CSV) if p.exists()]
+        fingerprint = index_fingerprint(FAISS_INDEX, *metadata)
+    except FileNotFoundError:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            model = MODEL_NAME if ENCODER_BACKEND == "torch" else f"{MODEL_NAME}+{ENCODER_BACKEND}"
+            _cache = RetrievalCache(fingerprint, model, SEARCH_PARAMS)
+        else:
+            _cache.refresh(fingerprint)
+        return _cache
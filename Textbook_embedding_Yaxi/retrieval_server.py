@@ -0,0 +1,158 @@
+"""Local retrieval daemon sharing one warm model and index between scripts.
+
+Start it once with ``python Textbook_embedding_Yaxi/retrieval_server.py``;
+``paths.fetch_rag_context`` then sends its queries here over localhost HTTP
+and only falls back to loading its own retriever when nothing is listening.
+
+Requests arriving from several clients within ``max_wait_ms`` of each other
+are merged into one ``search_batch`` call (micro-batching), so concurrent
+runners share a single encode + FAISS search.
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import urlparse
+
+from paths import RETRIEVAL_SERVER_URL
+
+MAX_BATCH = 64
+MAX_WAIT_MS = 5.0
+CLIENT_TIMEOUT = 30.0
+
+
+class MicroBatcher:
+    """Collects search jobs from many threads and runs them in merged batches."""
+
+    def __init__(self, retriever, max_batch: int = MAX_BATCH,
+                 max_wait_ms: float = MAX_WAIT_MS):
+        self.retriever = retriever
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._jobs = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, queries: Sequence[str], k: int) -> List[List[Dict]]:
+        job = (list(queries), k, Future())
+        self._jobs.put(job)
+        return job[2].result()
+
+    def _run(self):
+        while True:
+            jobs = [self._jobs.get()]
+            pending = len(jobs[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while pending < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    job = self._jobs.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                pending += len(job[0])
+            self._dispatch(jobs)
+
+    def _dispatch(self, jobs):
+        queries = [q for job in jobs for q in job[0]]
+        k = max(job[1] for job in jobs)
+        try:
+            results = self.retriever.search_batch(queries, k)
+        except Exception as e:
+            for job in jobs:
+                job[2].set_exception(e)
+            return
+        offset = 0
+        for job_queries, job_k, future in jobs:
+            chunk = results[offset:offset + len(job_queries)]
+            future.set_result([hits[:job_k] for hits in chunk])
+            offset += len(job_queries)
+
+
+def make_handler(batcher: MicroBatcher):
+    class RetrievalHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"status": "ok"})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/search":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                results = batcher.submit(body["queries"], int(body.get("k", 5)))
+            except (KeyError, ValueError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+                return
+            self._reply(200, {"results": results})
+
+        def _reply(self, status, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass  # one line per query would drown the console
+
+    return RetrievalHandler
+
+
+def remote_search_batch(queries: Sequence[str], k: int = 5,
+                        url: str = RETRIEVAL_SERVER_URL,
+                        timeout: float = CLIENT_TIMEOUT) -> Optional[List[List[Dict]]]:
+    """Search via the daemon; return ``None`` if it is not reachable or the
+    reply is not a retrieval server's (something else on the port)."""
+    data = json.dumps({"queries": list(queries), "k": k}).encode("utf-8")
+    request = urllib.request.Request(
+        url.rstrip("/") + "/search", data=data,
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as resp:
+            return json.loads(resp.read())["results"]
+    except (urllib.error.URLError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def serve(url: str = RETRIEVAL_SERVER_URL, max_batch: int = MAX_BATCH,
+          max_wait_ms: float = MAX_WAIT_MS):
+    from retriever import get_retriever
+
+    parsed = urlparse(url)
+    print("📦 Loading retriever...")
+    batcher = MicroBatcher(get_retriever(), max_batch, max_wait_ms)
+    server = ThreadingHTTPServer((parsed.hostname, parsed.port), make_handler(batcher))
+    print(f"✅ Retrieval server listening on {url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=RETRIEVAL_SERVER_URL)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    args = parser.parse_args()
+    serve(args.url, args.max_batch, args.max_wait_ms)
@@ -0,0 +1,109 @@
+"""In-process FAISS retriever over the textbook index.
+
+Loads the embedding model, FAISS index and chunk metadata once and then
+serves any number of ``search`` calls without re-reading them.
+"""
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from index_factory import DEFAULT_EF_SEARCH, DEFAULT_NPROBE, set_search_params
+from instrumentation import span
+from metadata_store import ChunkStore, chunk_store_exists
+from paths import FAISS_INDEX, METADATA_CSV, METADATA_STORE
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+DEFAULT_K = 5
+ENCODE_BATCH_SIZE = 256
+# Search parameters of the process-wide retriever (and the daemon); part of
+# the retrieval cache key
+SEARCH_PARAMS = {"nprobe": DEFAULT_NPROBE, "ef_search": DEFAULT_EF_SEARCH}
+
+
+class FaissRetriever:
+    def __init__(self, index_path=FAISS_INDEX, metadata_path=METADATA_STORE,
+                 model_name: str = MODEL_NAME, nprobe: int = DEFAULT_NPROBE,
+                 ef_search: int = DEFAULT_EF_SEARCH, backend: Optional[str] = None):
+        import faiss
+        from encoders import load_encoder
+
+        self.model_name = model_name
+        self.load_times = {}  # seconds per component, for benchmark_retrieval.py
+        start = time.perf_counter()
+        self.model = load_encoder(model_name, backend)  # torch or ONNX, see encoders.py
+        self.load_times["model"] = time.perf_counter() - start
+        start = time.perf_counter()
+        self.index = faiss.read_index(str(index_path))
+        set_search_params(self.index, nprobe, ef_search)
+        self.load_times["index"] = time.perf_counter() - start
+        start = time.perf_counter()
+        if chunk_store_exists(metadata_path):
+            self.metadata = ChunkStore(metadata_path)
+        elif Path(metadata_path) != METADATA_STORE:
+            # the legacy CSV below belongs to the textbook index only
+            raise FileNotFoundError(f"No chunk store at {metadata_path}")
+        else:
+            # Index built before the chunk store existed: parse the CSV once
+            import pandas as pd
+
+            self.metadata = dict(enumerate(pd.read_csv(METADATA_CSV).to_dict("records")))
+        self.load_times["metadata"] = time.perf_counter() - start
+        # Encoder calls and faiss search are not guaranteed to
+        # be safe under concurrent calls from several threads.
+        self._lock = threading.Lock()
+
+    def search(self, query: str, k: int = DEFAULT_K) -> List[Dict]:
+        """Return the top-``k`` chunks for ``query``, nearest first."""
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries: Sequence[str], k: int = DEFAULT_K,
+                     batch_size: int = ENCODE_BATCH_SIZE) -> List[List[Dict]]:
+        """Encode all ``queries`` in batches and run one FAISS search for them."""
+        import numpy as np
+
+        queries = list(queries)
+        if not queries:
+            return []
+        with self._lock:
+            with span("retrieval.encode"):
+                embeddings = self.model.encode(queries, batch_size=batch_size)
+            with span("retrieval.search"):
+                D, I = self.index.search(np.asarray(embeddings, dtype="float32"), k)
+        with span("retrieval.lookup"):
+            return [self._hits(dists, idxs) for dists, idxs in zip(D, I)]
+
+    def search_bank(self, questions: Iterable[Dict], k: int = DEFAULT_K,
+                    text_key: str = "question") -> Dict[str, List[Dict]]:
+        """Retrieve for a whole question bank, keyed by question ``id``."""
+        questions = list(questions)
+        results = self.search_batch([q[text_key] for q in questions], k)
+        return {q["id"]: hits for q, hits in zip(questions, results)}
+
+    def _hits(self, dists, idxs) -> List[Dict]:
+        hits = []
+        for dist, idx in zip(dists, idxs):
+            if idx < 0:  # fewer than k vectors in the index
+                continue
+            row = self.metadata.get(int(idx))
+            hits.append({
+                "id": int(idx),
+                "source": row.get("source", ""),
+                "text": row["text"],
+                "distance": float(dist),
+            })
+        return hits
+
+
+_retriever: Optional[FaissRetriever] = None
+_retriever_lock = threading.Lock()
+
+
+def get_retriever() -> FaissRetriever:
+    """Return the process-wide retriever, loading it on first use."""
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                _retriever = FaissRetriever(**SEARCH_PARAMS)
+    return _retriever
@@ -0,0 +1,182 @@
+"""Bounded-concurrency helpers for the question-bank runners and harvesters."""
+import csv
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional
+
+
+def is_rate_limit(exc: Exception) -> bool:
+    """True for HTTP 429 / rate-limit errors from the OpenAI, Ollama or urllib clients."""
+    if getattr(exc, "status_code", None) == 429 or getattr(exc, "code", None) == 429:
+        return True
+    return "ratelimit" in type(exc).__name__.lower()
+
+
+def call_with_backoff(fn: Callable, *args, retries: int = 5, base_delay: float = 1.0,
+                      max_delay: float = 60.0, **kwargs):
+    """Call ``fn`` and retry on failure with exponential backoff and jitter.
+
+    Rate-limit errors back off twice as long as other failures. The last
+    exception is re-raised once ``retries`` attempts have been used.
+    """
+    for attempt in range(retries):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries - 1:
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            if is_rate_limit(e):
+                delay = min(max_delay, delay * 2)
+            delay *= 1 + random.random() * 0.25
+            print(f"⚠️ {type(e).__name__} (attempt {attempt+1}/{retries}), retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: at most ``rate`` calls per second.
+
+    Up to ``capacity`` tokens accumulate while idle, so that many calls may
+    go out at once. The default of one spaces calls ``1 / rate`` apart, which
+    keeps every one-second window within ``rate`` (a capacity of ``rate``
+    would allow about ``2 * rate`` in the first second after start-up or an
+    idle spell). ``acquire`` blocks until a token is free.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_DONE = object()
+
+
+def run_in_order(items: Iterable, fn: Callable, max_workers: int = 1,
+                 on_result: Optional[Callable] = None) -> list:
+    """Run ``fn(item)`` for every item with at most ``max_workers`` in flight.
+
+    ``on_result(item, result)`` is called in the original item order as soon
+    as each result and all results before it are done, so CSV rows come out
+    in a deterministic order while later items are still running.
+    """
+    items = list(items)
+    if max_workers <= 1:
+        results = []
+        for item in items:
+            result = fn(item)
+            if on_result is not None:
+                on_result(item, result)
+            results.append(result)
+        return results
+
+    # Only ``2 * max_workers`` items are queued at a time, and on an error or
+    # Ctrl-C the queued ones are cancelled instead of run: an interrupted run
+    # stops making (possibly paid) model calls after the ones in flight.
+    results = []
+    window = deque()
+    pending = iter(items)
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for item in pending:
+            window.append((item, pool.submit(fn, item)))
+            if len(window) >= 2 * max_workers:
+                break
+        while window:
+            item, future = window.popleft()
+            result = future.result()
+            next_item = next(pending, _DONE)
+            if next_item is not _DONE:
+                window.append((next_item, pool.submit(fn, next_item)))
+            if on_result is not None:
+                on_result(item, result)
+            results.append(result)
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+    return results
+
+
+class ResultWriter:
+    """Append-only CSV writer for runner output with fsync checkpoints.
+
+    With ``resume=True`` an existing file is kept: rows for which
+    ``is_valid(row)`` is false are dropped (so those questions are asked
+    again) and the ids of the remaining rows are exposed as ``done_ids``.
+    Without it the file is started from scratch, as before.
+    """
+
+    def __init__(self, path, fieldnames: List[str], resume: bool = False,
+                 is_valid: Optional[Callable[[dict], bool]] = None,
+                 fsync_every: int = 10):
+        self.path = path
+        self.fieldnames = fieldnames
+        self.fsync_every = fsync_every
+        self.done_ids = set()
+        if resume and os.path.exists(path):
+            self._keep_valid_rows(is_valid or (lambda row: True))
+        else:
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                csv.DictWriter(f, fieldnames=fieldnames).writeheader()
+        self._file = open(path, "a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames)
+        self._pending = 0
+
+    def _keep_valid_rows(self, is_valid):
+        with open(self.path, newline="", encoding="utf-8") as f:
+            text = f.read()
+        rows = list(csv.DictReader(text.splitlines(keepends=True)))
+        if rows and not text.endswith("\n"):
+            rows.pop()  # last row was cut off mid-write
+        rows = [row for row in rows if row.get("id") and is_valid(row)]
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=self.fieldnames, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.done_ids = {row["id"] for row in rows}
+
+    def writerow(self, row: dict):
+        self._writer.writerow(row)
+        self.done_ids.add(row["id"])
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.checkpoint()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
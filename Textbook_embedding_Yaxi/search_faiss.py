@@ -1,36 +1,31 @@
-import sys
-from paths import FAISS_INDEX, METADATA_CSV
+"""Print the top-5 textbook chunks for a query.
 
-try:
-    from sentence_transformers import SentenceTransformer
-    import faiss
-    import numpy as np
-    import pandas as pd
-except Exception as e:
-    print("❌ Import error:", e)
-    sys.exit(1)
+Answers from the retrieval cache or the warm retrieval daemon when either
+can, so a cold start costs only this script's stdlib imports; the model
+and index are loaded in-process only when neither is available.
+"""
+import sys
 
-#print("✅ All modules imported")
+from paths import search_chunks
 
-query = " ".join(sys.argv[1:]).strip()
-print(f"🔍 Received query: {query!r}", file=sys.stderr)
 
-if not query:
-    print("❌ No query provided.", file=sys.stderr)
-    sys.exit(1)
+def main(argv=None) -> int:
+    query = " ".join(sys.argv[1:] if argv is None else argv).strip()
+    print(f"🔍 Received query: {query!r}", file=sys.stderr)
 
+    if not query:
+        print("❌ No query provided.", file=sys.stderr)
+        return 1
 
-try:
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    index = faiss.read_index(str(FAISS_INDEX))
-    metadata = pd.read_csv(METADATA_CSV)
+    try:
+        # output top-5 chunks
+        for hit in search_chunks([query], 5)[0]:
+            print(hit["text"].replace("\n", " "))
+    except Exception as e:
+        print("❌ Runtime error:", e, file=sys.stderr)
+        return 1
+    return 0
 
-    embedding = model.encode([query])
-    D, I = index.search(np.array(embedding).astype("float32"), 5)
 
-    # output top-5 chunks
-    for idx in I[0]:
-        print(metadata.iloc[idx]["text"].replace("\n", " "))
-except Exception as e:
-    print("❌ Runtime error:", e, file=sys.stderr)
-    sys.exit(1)
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,3 @@
-import ollama
-
 query = "What are the mechanical properties of collagen?"
 context = "Collagen-based biomaterials provide high tensile strength and support cellular adhesion."
 
@@ -11,7 +9,11 @@ QUESTION:
 
 ANSWER:"""
 
-response = ollama.chat(model="llama3", messages=[
-    {"role": "user", "content": prompt}
-])
-print(response['message']['content'])
\ No newline at end of file
+
+if __name__ == "__main__":
+    import ollama
+
+    response = ollama.chat(model="llama3", messages=[
+        {"role": "user", "content": prompt}
+    ])
+    print(response['message']['content'])
@@ -1,100 +1,312 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
-import pandas as pd
-import fitz  # PyMuPDF
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
-from typing import List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
 
-from paths import EXPORT_TEXTBOOK_CSV, FAISS_INDEX, METADATA_CSV, TEXTBOOK_DIR
+from chunking import Chunk, chunk_spans, page_starts_for
+from embedding import encode_to_array
+from encoders import ENCODER_BACKEND, load_encoder
+from index_factory import build_index, recall_at_k, write_index
+from metadata_store import ChunkStore, chunk_store_exists, write_chunk_store
+from paths import EXPORT_TEXTBOOK_CSV, FAISS_INDEX, INDEX_MANIFEST, METADATA_STORE, TEXTBOOK_DIR
+
+# pandas / fitz / faiss / numpy are imported inside the functions that use
+# them: importing this module stays cheap, and the spawned extraction
+# workers only ever load PyMuPDF.
 
 # === CONFIG ===
 CSV_PATH = str(EXPORT_TEXTBOOK_CSV)
 PDF_DIR = str(TEXTBOOK_DIR) + os.sep
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 CHUNK_SIZE = 3000
+CHUNK_STRATEGY = "sentence"  # sentence | tokens | window, see chunking.py
 FAISS_INDEX_PATH = str(FAISS_INDEX)
-METADATA_PATH = str(METADATA_CSV)
-
-print("🔧 Configuration loaded.")
-print(f"CSV path: {CSV_PATH}")
-print(f"PDF directory: {PDF_DIR}")
-print(f"Model: {MODEL_NAME}")
-print(f"Chunk size: {CHUNK_SIZE}\n")
+METADATA_PATH = str(METADATA_STORE) + ".jsonl"
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "flat")  # flat | hnsw | ivf | ivfpq
+RECALL_K = 10
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", os.cpu_count() or 1))
+EMBED_BATCH_SIZE = 512  # chunks per model.encode call, across book boundaries
+MANIFEST_PATH = str(INDEX_MANIFEST)  # per-PDF content hashes for incremental builds
+ID_STRIDE = 1 << 20  # vector id = file_id * ID_STRIDE + chunk number
 
 # === FUNCTIONS ===
-def extract_text_from_pdf(pdf_path: str) -> str:
+def extract_pages_from_pdf(pdf_path: str) -> List[str]:
+    import fitz  # PyMuPDF
+
     try:
         doc = fitz.open(pdf_path)
-        return "\n".join(page.get_text() for page in doc)
+        return [page.get_text() for page in doc]
     except Exception as e:
         print(f"❌ Error reading {pdf_path}: {e}")
-        return ""
-
-def chunk_text(text: str, max_length: int = 1000) -> List[str]:
-    chunks = []
-    while len(text) > max_length:
-        split_idx = text.rfind('.', 0, max_length)
-        split_idx = split_idx if split_idx != -1 else max_length
-        chunks.append(text[:split_idx+1].strip())
-        text = text[split_idx+1:].strip()
-    if text:
-        chunks.append(text)
-    return chunks
-
-# === LOAD MODEL ===
-print("📦 Loading model...")
-model = SentenceTransformer(MODEL_NAME)
-embedding_dim = model.get_sentence_embedding_dimension()
-print(f"✅ Model loaded: Embedding dimension = {embedding_dim}")
-
-# === LOAD CSV ===
-print("\n📄 Loading CSV...")
-df = pd.read_csv(CSV_PATH)
-print(f"✅ Loaded {len(df)} rows from CSV.")
-file_paths = df['file_path'].dropna().apply(lambda x: str(x).strip()).unique()
-print(f"📚 Found {len(file_paths)} unique file paths.\n")
-
-# === INIT FAISS ===
-index = faiss.IndexFlatL2(embedding_dim)
-metadata = []
-
-# === PROCESS PDFs ===
-for file_name in file_paths:
-    pdf_path = os.path.join(PDF_DIR, f"{file_name}.pdf")
-    
-    if not os.path.isfile(pdf_path):
-        print(f"❌ File not found: {pdf_path}")
-        continue
-
-    print(f"\n📄 Processing PDF: {pdf_path}")
-    text = extract_text_from_pdf(pdf_path)
-    
+        return []
+
+def extract_and_chunk(file_name: str, pdf_path: str, chunk_size: int) -> Tuple[str, List[Chunk]]:
+    """Worker-process stage: PDF -> text -> chunks with char offsets and pages."""
+    pages = extract_pages_from_pdf(pdf_path)
+    text = "\n".join(pages)
     if not text.strip():
-        print("⚠️ No text extracted from PDF. Skipping.")
-        continue
+        return file_name, []
+    return file_name, chunk_spans(text, CHUNK_STRATEGY, max_length=chunk_size,
+                                  page_starts=page_starts_for(pages))
 
-    chunks = chunk_text(text, max_length=CHUNK_SIZE)
-    print(f"✂️  Chunked into {len(chunks)} segments.")
+def iter_chunked_pdfs(jobs, workers: int = EXTRACT_WORKERS, chunk_size: int = CHUNK_SIZE):
+    """Yield ``(file_name, chunks)`` in job order while a process pool works ahead.
 
-    try:
-        embeddings = model.encode(chunks, show_progress_bar=True)
-    except Exception as e:
-        print(f"❌ Embedding failed for {pdf_path}: {e}")
-        continue
-
-    index.add(np.array(embeddings).astype("float32"))
-    metadata.extend([{"source": file_name, "text": chunk} for chunk in chunks])
-    print(f"📌 Added {len(chunks)} embeddings to FAISS.")
-
-# === SAVE FAISS INDEX AND METADATA ===
-print("\n💾 Saving FAISS index and metadata...")
-faiss.write_index(index, FAISS_INDEX_PATH)
-pd.DataFrame(metadata).to_csv(
-    METADATA_PATH,
-    index=False,
-    escapechar='\\',
-    quoting=1  # csv.QUOTE_ALL
-)
-print(f"\n✅ FAISS index saved to: {FAISS_INDEX_PATH}")
-print(f"✅ Metadata saved to: {METADATA_PATH}")
\ No newline at end of file
+    At most ``2 * workers`` PDFs are in flight, which bounds how many chunked
+    books can pile up waiting for the embedding stage.
+    """
+    if workers <= 1:
+        for file_name, pdf_path in jobs:
+            yield extract_and_chunk(file_name, pdf_path, chunk_size)
+        return
+
+    jobs = iter(jobs)
+    # spawn, not fork: the parent already holds a loaded torch model
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        pending = deque()
+        for file_name, pdf_path in jobs:
+            pending.append(pool.submit(extract_and_chunk, file_name, pdf_path, chunk_size))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for file_name, pdf_path in jobs:
+                pending.append(pool.submit(extract_and_chunk, file_name, pdf_path, chunk_size))
+                break
+            yield result
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def chunk_ids(file_id: int, n_chunks: int):
+    import numpy as np
+
+    return np.arange(file_id * ID_STRIDE, file_id * ID_STRIDE + n_chunks, dtype="int64")
+
+def embed_files(model, jobs, file_ids: Dict[str, int]):
+    """Extract, chunk and embed ``jobs`` (pipelined), with stable vector ids.
+
+    Returns ``(vectors, ids, records, chunk_counts, failed_files)``.
+    """
+    import numpy as np
+
+    embedding_dim = model.get_sentence_embedding_dimension()
+    all_embeddings, all_ids, records = [], [], []
+    chunk_counts, failed = {}, set()
+    batch_texts, batch_meta = [], []
+
+    def embed_batch():
+        try:
+            embeddings = encode_to_array(model, batch_texts)
+        except Exception as e:
+            print(f"❌ Embedding failed for a batch of {len(batch_texts)} chunks: {e}")
+            failed.update(meta["source"] for _, meta in batch_meta)
+        else:
+            all_embeddings.append(embeddings)
+            all_ids.extend(vid for vid, _ in batch_meta)
+            records.extend(meta for _, meta in batch_meta)
+            print(f"📌 Embedded {len(batch_texts)} chunks ({len(records)} total).")
+        batch_texts.clear()
+        batch_meta.clear()
+
+    # Worker processes extract and chunk PDFs while this process embeds
+    # finished chunks in large batches.
+    for file_name, chunks in iter_chunked_pdfs(jobs):
+        chunk_counts[file_name] = len(chunks)
+        if not chunks:
+            print(f"⚠️ No text extracted from {file_name}. Skipping.")
+            continue
+        print(f"✂️  {file_name}: chunked into {len(chunks)} segments.")
+        ids = chunk_ids(file_ids[file_name], len(chunks))
+        batch_texts.extend(chunk.text for chunk in chunks)
+        batch_meta.extend((int(vid), {"source": file_name, "text": chunk.text,
+                                      "page_start": chunk.page_start, "page_end": chunk.page_end,
+                                      "char_start": chunk.start, "char_end": chunk.end})
+                          for vid, chunk in zip(ids, chunks))
+        if len(batch_texts) >= EMBED_BATCH_SIZE:
+            embed_batch()
+    if batch_texts:
+        embed_batch()
+
+    vectors = (np.concatenate(all_embeddings) if all_embeddings
+               else np.empty((0, embedding_dim), dtype="float32"))
+    return vectors, np.asarray(all_ids, dtype="int64"), records, chunk_counts, failed
+
+def manifest_entries(jobs, hashes, file_ids, chunk_counts, failed):
+    # A file whose embedding failed keeps its file_id (so its partial vectors
+    # are removed next time) but no hash, so the next run retries it.
+    return {
+        file_name: {
+            "sha256": None if file_name in failed else hashes[file_name],
+            "file_id": file_ids[file_name],
+            "n_chunks": chunk_counts.get(file_name, 0),
+        }
+        for file_name, _ in jobs
+    }
+
+def save_manifest(manifest):
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def full_build(model, jobs, hashes, settings):
+    import faiss
+
+    file_ids = {file_name: i for i, (file_name, _) in enumerate(jobs)}
+    vectors, ids, records, chunk_counts, failed = embed_files(model, jobs, file_ids)
+
+    # === BUILD FAISS INDEX ===
+    # Built once at the end: IVF/PQ indexes must be trained on the whole
+    # corpus before any vector is added. IndexIDMap2 keeps the stable ids.
+    embedding_dim = model.get_sentence_embedding_dimension()
+    print(f"\n🧱 Building {INDEX_TYPE} index over {len(vectors)} vectors...")
+    if len(vectors):
+        index = build_index(INDEX_TYPE, vectors, ids=ids)
+    else:
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(embedding_dim))
+    if INDEX_TYPE != "flat" and len(vectors):
+        recall = recall_at_k(index, vectors, k=RECALL_K, ids=ids)
+        print(f"🎯 Recall@{RECALL_K} vs exact flat search: {recall:.3f}")
+
+    # === SAVE FAISS INDEX, METADATA AND MANIFEST ===
+    print("\n💾 Saving FAISS index and metadata...")
+    # Store first, index second, each swapped in atomically: a failure never
+    # leaves a new index next to a store that lacks its vectors' chunks
+    write_chunk_store(METADATA_STORE, records, ids=ids)
+    write_index(index, FAISS_INDEX_PATH)
+    save_manifest({
+        "settings": settings,
+        "next_file_id": len(jobs),
+        "files": manifest_entries(jobs, hashes, file_ids, chunk_counts, failed),
+    })
+
+def incremental_update(model, jobs, hashes, manifest) -> bool:
+    """Re-embed only added/changed PDFs and drop vectors of removed ones.
+
+    Returns ``False`` if the index type cannot remove vectors (HNSW), in
+    which case the caller falls back to a full rebuild.
+    """
+    import faiss
+    import numpy as np
+
+    files = manifest["files"]
+    current = {file_name for file_name, _ in jobs}
+    stale = [name for name, entry in files.items()
+             if name not in current or entry["sha256"] != hashes[name]]
+    todo = [(name, path) for name, path in jobs
+            if name not in files or files[name]["sha256"] != hashes[name]]
+    if not stale and not todo:
+        print("✅ Index is up to date; nothing to re-embed.")
+        return True
+    print(f"🔄 Incremental update: {len(todo)} added/changed, "
+          f"{len(set(stale) - current)} removed.")
+
+    index = faiss.read_index(FAISS_INDEX_PATH)
+    stale_ids = [chunk_ids(files[name]["file_id"], files[name]["n_chunks"]) for name in stale]
+    if stale_ids:
+        try:
+            index.remove_ids(np.concatenate(stale_ids))
+        except RuntimeError as e:
+            print(f"⚠️ {INDEX_TYPE} index cannot remove vectors ({e}).")
+            return False
+
+    # Keep metadata for untouched files; read it fully before the store is
+    # overwritten, since the old files are memory-mapped.
+    stale_file_ids = {files[name]["file_id"] for name in stale}
+    store = ChunkStore(METADATA_STORE)
+    kept = [(vid, record) for vid, record in store.items()
+            if vid // ID_STRIDE not in stale_file_ids]
+    store.close()
+
+    file_ids = {}
+    for name, _ in todo:
+        if name in files:
+            file_ids[name] = files[name]["file_id"]
+        else:
+            file_ids[name] = manifest["next_file_id"]
+            manifest["next_file_id"] += 1
+    vectors, ids, records, chunk_counts, failed = embed_files(model, todo, file_ids)
+    if len(vectors):
+        index.add_with_ids(vectors, ids)
+
+    print("\n💾 Saving FAISS index and metadata...")
+    write_chunk_store(
+        METADATA_STORE,
+        [record for _, record in kept] + records,
+        ids=[vid for vid, _ in kept] + ids.tolist(),
+    )
+    write_index(index, FAISS_INDEX_PATH)
+    for name in set(stale) - current:
+        del files[name]
+    files.update(manifest_entries(todo, hashes, file_ids, chunk_counts, failed))
+    save_manifest(manifest)
+    return True
+
+def main(full: bool = False):
+    import pandas as pd
+
+    print("🔧 Configuration loaded.")
+    print(f"CSV path: {CSV_PATH}")
+    print(f"PDF directory: {PDF_DIR}")
+    print(f"Model: {MODEL_NAME}")
+    print(f"Chunk size: {CHUNK_SIZE}")
+    print(f"Index type: {INDEX_TYPE}")
+    print(f"Extraction workers: {EXTRACT_WORKERS}\n")
+
+    # === LOAD MODEL ===
+    print("📦 Loading model...")
+    model = load_encoder(MODEL_NAME)
+    embedding_dim = model.get_sentence_embedding_dimension()
+    print(f"✅ Model loaded: Embedding dimension = {embedding_dim}")
+
+    # === LOAD CSV ===
+    print("\n📄 Loading CSV...")
+    df = pd.read_csv(CSV_PATH)
+    print(f"✅ Loaded {len(df)} rows from CSV.")
+    file_paths = df['file_path'].dropna().apply(lambda x: str(x).strip()).unique()
+    print(f"📚 Found {len(file_paths)} unique file paths.\n")
+
+    jobs = []
+    for file_name in file_paths:
+        pdf_path = os.path.join(PDF_DIR, f"{file_name}.pdf")
+        if not os.path.isfile(pdf_path):
+            print(f"❌ File not found: {pdf_path}")
+            continue
+        jobs.append((file_name, pdf_path))
+    hashes = {file_name: file_sha256(pdf_path) for file_name, pdf_path in jobs}
+
+    # === INCREMENTAL UPDATE OR FULL BUILD ===
+    settings = {"model": MODEL_NAME, "chunk_size": CHUNK_SIZE,
+                "chunk_strategy": CHUNK_STRATEGY, "index_type": INDEX_TYPE,
+                "encoder": ENCODER_BACKEND}
+    manifest = None
+    if not full and os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            manifest = json.load(f)
+    can_update = (
+        manifest is not None
+        and manifest.get("settings") == settings
+        and os.path.exists(FAISS_INDEX_PATH)
+        and chunk_store_exists(METADATA_STORE)
+    )
+    if not (can_update and incremental_update(model, jobs, hashes, manifest)):
+        print("🏗️ Full rebuild.")
+        full_build(model, jobs, hashes, settings)
+    print(f"\n✅ FAISS index saved to: {FAISS_INDEX_PATH}")
+    print(f"✅ Metadata saved to: {METADATA_PATH}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true",
+                        help="ignore the manifest and re-embed every PDF")
+    main(parser.parse_args().full)